@@ -40,6 +40,12 @@ CONF.import_opt('cloudkitty_period',
                 'processor')
 
 
+def _next_marker(items, limit, key):
+    """Return the marker of the next page, None on the last page."""
+    if limit and len(items) == limit:
+        return items[-1][key]
+
+
 class ExistAccountController(rest.RestController):
     """Manages operations on account."""
 
@@ -133,9 +139,9 @@ class ExistAccountController(rest.RestController):
         return models.UserAccount(**account)
 
     @wsexpose(models.Charges, wtypes.text, datetime.datetime,
-              datetime.datetime, int, int)
+              datetime.datetime, int, int, wtypes.text)
     def charges(self, type=None, start_time=None,
-                end_time=None, limit=None, offset=None):
+                end_time=None, limit=None, offset=None, marker=None):
         """Get this account's charge records."""
         policy.check_policy(HOOK.context, "charges:get",
                             action="account:charges")
@@ -148,28 +154,25 @@ class ExistAccountController(rest.RestController):
         user_id = acl.get_limited_to_user(
             HOOK.headers, 'account:charge') or self._id
 
-        charges = HOOK.conductor_rpcapi.get_charges(HOOK.context,
-                                                    user_id=user_id,
-                                                    type=type,
-                                                    limit=limit,
-                                                    offset=offset,
-                                                    start_time=start_time,
-                                                    end_time=end_time)
+        result = HOOK.conductor_rpcapi.get_charges_with_totals(
+            HOOK.context,
+            user_id=user_id,
+            type=type,
+            limit=limit,
+            offset=offset,
+            marker=marker,
+            start_time=start_time,
+            end_time=end_time)
+        charges = result['charges']
         charges_list = []
         for charge in charges:
             charges_list.append(models.Charge(**charge))
 
-        total_price, total_count = (HOOK.conductor_rpcapi.
-                                    get_charges_price_and_count(
-                                        HOOK.context,
-                                        user_id=user_id,
-                                        type=type,
-                                        start_time=start_time,
-                                        end_time=end_time))
-
-        return models.Charges.transform(total_price=total_price,
-                                        total_count=total_count,
-                                        charges=charges_list)
+        return models.Charges.transform(
+            total_price=result['total_price'],
+            total_count=result['total_count'],
+            charges=charges_list,
+            next_marker=_next_marker(charges, limit, 'charge_id'))
 
     @wsexpose(models.Estimate)
     def estimate(self):
@@ -207,10 +210,10 @@ class ChargesController(rest.RestController):
 
     @wsexpose(models.Charges, wtypes.text, wtypes.text,
               datetime.datetime, datetime.datetime, int, int,
-              wtypes.text, wtypes.text)
+              wtypes.text, wtypes.text, wtypes.text)
     def get(self, user_id=None, type=None, start_time=None,
             end_time=None, limit=None, offset=None,
-            sort_key='created_at', sort_dir='desc'):
+            sort_key='created_at', sort_dir='desc', marker=None):
         """Get all charges of all account."""
 
         policy.check_policy(HOOK.context, "charges:all",
@@ -235,33 +238,29 @@ class ChargesController(rest.RestController):
                                          email=email)
             return users[user_id]
 
-        charges = HOOK.conductor_rpcapi.get_charges(
+        result = HOOK.conductor_rpcapi.get_charges_with_totals(
             HOOK.context,
             user_id=user_id,
             type=type,
             limit=limit,
             offset=offset,
+            marker=marker,
             start_time=start_time,
             end_time=end_time,
             sort_key=sort_key,
             sort_dir=sort_dir)
+        charges = result['charges']
         charges_list = []
         for charge in charges:
             acharge = models.Charge.from_db_model(charge)
             acharge.target = _get_user(charge['user_id'])
             charges_list.append(acharge)
 
-        total_price, total_count = (HOOK.conductor_rpcapi.
-                                    get_charges_price_and_count(
-                                        HOOK.context,
-                                        user_id=user_id,
-                                        type=type,
-                                        start_time=start_time,
-                                        end_time=end_time))
-
-        return models.Charges.transform(total_price=total_price,
-                                        total_count=total_count,
-                                        charges=charges_list)
+        return models.Charges.transform(
+            total_price=result['total_price'],
+            total_count=result['total_count'],
+            charges=charges_list,
+            next_marker=_next_marker(charges, limit, 'charge_id'))
 
 
 class AccountController(rest.RestController):
@@ -292,8 +291,9 @@ class AccountController(rest.RestController):
             LOG.error('Fail to create account: %s' % data.as_dict())
             raise exception.DBError(reason=e)
 
-    @wsexpose(models.AdminAccounts, bool, int, int, wtypes.text)
-    def get_all(self, owed=None, limit=None, offset=None, duration=None):
+    @wsexpose(models.AdminAccounts, bool, int, int, wtypes.text, wtypes.text)
+    def get_all(self, owed=None, limit=None, offset=None, duration=None,
+                marker=None):
         """Get this account."""
         policy.check_policy(HOOK.context, "account:all", action="account:all")
         owed = False
@@ -315,17 +315,22 @@ class AccountController(rest.RestController):
                 owed=owed,
                 limit=limit,
                 offset=offset,
+                marker=marker,
                 active_from=active_from)
             count = len(accounts)
         except exception.NotAuthorized as e:
             LOG.error('Failed to get all accounts')
             raise exception.NotAuthorized()
+        except exception.MarkerNotFound:
+            raise
         except Exception as e:
             LOG.error('Failed to get all accounts')
             raise exception.DBError(reason=e)
 
+        next_marker = _next_marker(accounts, limit, 'user_id')
         accounts = [models.AdminAccount.transform(**account)
                     for account in accounts]
 
         return models.AdminAccounts.transform(total_count=count,
-                                              accounts=accounts)
+                                              accounts=accounts,
+                                              next_marker=next_marker)
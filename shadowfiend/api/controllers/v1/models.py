@@ -64,6 +64,7 @@ class AdminAccount(APIBase):
 class AdminAccounts(APIBase):
     total_count = int
     accounts = [AdminAccount]
+    next_marker = wtypes.text
 
 
 class User(APIBase):
@@ -119,6 +120,7 @@ class Charges(APIBase):
     total_price = float
     total_count = int
     charges = [Charge]
+    next_marker = wtypes.text
 
 
 class Estimate(APIBase):
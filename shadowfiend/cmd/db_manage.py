@@ -20,6 +20,7 @@ from shadowfiend.common import context
 from shadowfiend.db import migration
 from shadowfiend.db import api as dbapi
 from shadowfiend.db import models as db_models
+from shadowfiend.processor.service import backfill
 from shadowfiend.services import keystone as keystone_client
 from shadowfiend.services.gnocchi import GnocchiClient
 
@@ -50,6 +51,14 @@ def do_init():
     synchronize_database()
 
 
+def do_backfill():
+    results = backfill.Backfill(
+        dbapi, window=CONF.command.window,
+        concurrency=CONF.command.concurrency).run(CONF.command.project)
+    for project_id, periods in sorted(results.items()):
+        print('%s: %d periods billed' % (project_id, periods))
+
+
 def synchronize_database():
     ctx = context.make_admin_context(all_tenants=True)
     context.set_ctx(ctx)
@@ -111,6 +120,16 @@ def add_command_parsers(subparsers):
     parser = subparsers.add_parser('init')
     parser.set_defaults(func=do_init)
 
+    parser = subparsers.add_parser('backfill')
+    parser.add_argument('--project', action='append',
+                        help='Project to backfill, all the rating projects '
+                             'by default. Can be repeated.')
+    parser.add_argument('--window', type=int, default=720,
+                        help='Periods read and billed at once.')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Projects backfilled at the same time.')
+    parser.set_defaults(func=do_backfill)
+
 
 command_opt = cfg.SubCommandOpt('command',
                                 title='Command',
@@ -23,6 +23,7 @@ from oslo_reports import guru_meditation_report as gmr
 from shadowfiend.common import service as oslo_service
 from shadowfiend.common import version
 
+from shadowfiend.processor.handlers import billing_owner
 from shadowfiend.processor.handlers import placeholder
 from shadowfiend.processor.service import service
 
@@ -40,6 +41,7 @@ def main():
 
     managers = [
         placeholder.Handler(),
+        billing_owner.Handler(),
     ]
 
     server = service.ProcessorService.create(binary='shadowfiend-processor',
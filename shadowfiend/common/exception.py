@@ -169,6 +169,10 @@ class EndpointNotFound(NotFound):
     code = 404
 
 
+class MarkerNotFound(NotFound):
+    message = "Marker %(marker)s could not be found"
+
+
 class AccountNotFound(NotFound):
     message = "Account %(user_id)s not found"
 
@@ -68,11 +68,12 @@ class API(rpc_service.API):
         return self._call(context, 'get_account', **kwargs)
 
     def get_accounts(self, context, owed=None, limit=None,
-                     offset=None, active_from=None):
+                     offset=None, active_from=None, marker=None):
         kwargs = dict(owed=owed,
                       limit=limit,
                       offset=offset,
-                      active_from=active_from)
+                      active_from=active_from,
+                      marker=marker)
         return self._call(context, 'get_accounts', **kwargs)
 
     def get_accounts_count(self, context, owed=None,
@@ -81,6 +82,9 @@ class API(rpc_service.API):
                       active_from=active_from)
         return self._call(context, 'get_accounts_count', **kwargs)
 
+    def get_expired_owed_accounts(self, context):
+        return self._call(context, 'get_expired_owed_accounts')
+
     def create_account(self, context, account):
         return self._call(context, 'create_account', **account)
 
@@ -101,6 +105,31 @@ class API(rpc_service.API):
                       **data)
         return self._call(context, 'update_account', **kwargs)
 
+    def update_accounts(self, context, items):
+        kwargs = dict(items=items)
+        return self._call(context, 'update_accounts', **kwargs)
+
+    def get_state_outbox(self, context, limit=None):
+        kwargs = dict(limit=limit)
+        return self._call(context, 'get_state_outbox', **kwargs)
+
+    def delete_state_outbox(self, context, ids):
+        kwargs = dict(ids=ids)
+        return self._call(context, 'delete_state_outbox', **kwargs)
+
+    def get_states(self, context, project_ids=None):
+        kwargs = dict(project_ids=project_ids)
+        return self._call(context, 'get_states', **kwargs)
+
+    def get_teardown_actions(self, context, project_id):
+        kwargs = dict(project_id=project_id)
+        return self._call(context, 'get_teardown_actions', **kwargs)
+
+    def set_teardown_actions(self, context, project_id, actions):
+        kwargs = dict(project_id=project_id,
+                      actions=actions)
+        return self._call(context, 'set_teardown_actions', **kwargs)
+
     def charge_account(self, context, user_id, **data):
         kwargs = dict(user_id=user_id,
                       **data)
@@ -108,7 +137,8 @@ class API(rpc_service.API):
 
     def get_charges(self, context, user_id=None, project_id=None, type=None,
                     start_time=None, end_time=None,
-                    limit=None, offset=None, sort_key=None, sort_dir=None):
+                    limit=None, offset=None, sort_key=None, sort_dir=None,
+                    marker=None):
         kwargs = dict(user_id=user_id,
                       project_id=project_id,
                       type=type,
@@ -116,7 +146,9 @@ class API(rpc_service.API):
                       end_time=end_time,
                       limit=limit,
                       offset=offset,
-                      sort_key=sort_key)
+                      sort_key=sort_key,
+                      sort_dir=sort_dir,
+                      marker=marker)
         return self._call(context, 'get_charges', **kwargs)
 
     def get_charges_price_and_count(self, context, user_id=None, type=None,
@@ -126,3 +158,18 @@ class API(rpc_service.API):
                       start_time=start_time,
                       end_time=end_time)
         return self._call(context, 'get_charges_price_and_count', **kwargs)
+
+    def get_charges_with_totals(self, context, user_id=None, type=None,
+                                start_time=None, end_time=None,
+                                limit=None, offset=None, sort_key=None,
+                                sort_dir=None, marker=None):
+        kwargs = dict(user_id=user_id,
+                      type=type,
+                      start_time=start_time,
+                      end_time=end_time,
+                      limit=limit,
+                      offset=offset,
+                      sort_key=sort_key,
+                      sort_dir=sort_dir,
+                      marker=marker)
+        return self._call(context, 'get_charges_with_totals', **kwargs)
@@ -43,6 +43,10 @@ class Handler(object):
         accounts = cls.dbapi.get_accounts(context, **kwargs)
         return accounts
 
+    def get_expired_owed_accounts(cls, context, **kwargs):
+        LOG.debug('get expired owed accounts: Received message from RPC.')
+        return cls.dbapi.get_expired_owed_accounts(context, **kwargs)
+
     def get_accounts_count(cls, context, **kwargs):
         LOG.debug('get accounts count: Received message from RPC.')
         accounts = cls.dbapi.get_accounts_count(context, **kwargs)
@@ -68,6 +72,10 @@ class Handler(object):
                                         kwargs.pop('user_id'),
                                         **kwargs)
 
+    def update_accounts(cls, context, **kwargs):
+        LOG.debug('update accounts: Received message from RPC.')
+        return cls.dbapi.update_accounts(context, **kwargs)
+
     def get_charges(cls, context, **kwargs):
         LOG.debug('get charges: Received message from RPC.')
         return cls.dbapi.get_charges(context, **kwargs)
@@ -75,3 +83,7 @@ class Handler(object):
     def get_charges_price_and_count(cls, context, **kwargs):
         LOG.debug('get_charges_price_and_count: Received message from RPC.')
         return cls.dbapi.get_charges_price_and_count(context, **kwargs)
+
+    def get_charges_with_totals(cls, context, **kwargs):
+        LOG.debug('get charges with totals: Received message from RPC.')
+        return cls.dbapi.get_charges_with_totals(context, **kwargs)
@@ -16,9 +16,25 @@
 from oslo_log import log
 from shadowfiend.db import api as dbapi
 from shadowfiend.db import models as db_models
+from shadowfiend.processor import api as processor_api
 
 LOG = log.getLogger(__name__)
 
+_PROCESSOR_API = None
+
+
+def notify_billing_owner_changed(context, project_id, user_id):
+    global _PROCESSOR_API
+    try:
+        if _PROCESSOR_API is None:
+            _PROCESSOR_API = processor_api.API()
+        _PROCESSOR_API.billing_owner_changed(context, project_id, user_id)
+    except Exception as e:
+        # NOTE: The processors look the owner up again on their next
+        # refresh of the billing owners.
+        LOG.warning("Fail to notify the processors of the billing owner "
+                    "change of project %s: %s" % (project_id, e))
+
 
 class Handler(object):
 
@@ -35,6 +51,9 @@ class Handler(object):
         cls.dbapi.change_billing_owner(context,
                                        kwargs['project_id'],
                                        kwargs['user_id'])
+        notify_billing_owner_changed(context,
+                                     kwargs['project_id'],
+                                     kwargs['user_id'])
 
     def create_project(cls, context, **kwargs):
         LOG.debug('Conductor Function: create_project.')
@@ -57,3 +76,23 @@ class Handler(object):
     def get_projects(cls, context, **kwargs):
         LOG.debug('Conductor Function: get_projects.')
         return cls.dbapi.get_projects(context, **kwargs)
+
+    def get_states(cls, context, **kwargs):
+        LOG.debug('Conductor Function: get_states.')
+        return cls.dbapi.get_states(context, **kwargs)
+
+    def get_state_outbox(cls, context, **kwargs):
+        LOG.debug('Conductor Function: get_state_outbox.')
+        return cls.dbapi.get_state_outbox(context, **kwargs)
+
+    def delete_state_outbox(cls, context, **kwargs):
+        LOG.debug('Conductor Function: delete_state_outbox.')
+        return cls.dbapi.delete_state_outbox(context, **kwargs)
+
+    def get_teardown_actions(cls, context, **kwargs):
+        LOG.debug('Conductor Function: get_teardown_actions.')
+        return cls.dbapi.get_teardown_actions(context, **kwargs)
+
+    def set_teardown_actions(cls, context, **kwargs):
+        LOG.debug('Conductor Function: set_teardown_actions.')
+        return cls.dbapi.set_teardown_actions(context, **kwargs)
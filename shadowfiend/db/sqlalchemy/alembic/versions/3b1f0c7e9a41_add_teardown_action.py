@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add teardown action
+Revision ID: 3b1f0c7e9a41
+Revises: d8f5d61a2234
+Create Date: 2018-03-20 15:02:11.530218
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3b1f0c7e9a41'
+down_revision = 'd8f5d61a2234'
+
+
+def upgrade():
+    op.create_table(
+        'teardown_action',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_id', sa.String(255), index=True),
+        sa.Column('resource_id', sa.String(255)),
+        sa.Column('service', sa.String(64)),
+        sa.Column('status', sa.String(16)),
+
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='UTF8'
+    )
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add teardown action unique constraint
+Revision ID: 4f7a2b9c5e13
+Revises: 9e4b1d6f2c38
+Create Date: 2018-04-12 10:21:47.305112
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4f7a2b9c5e13'
+down_revision = '9e4b1d6f2c38'
+
+
+def upgrade():
+    op.create_unique_constraint('uq_teardown_action_resource',
+                                'teardown_action',
+                                ['project_id', 'service', 'resource_id'])
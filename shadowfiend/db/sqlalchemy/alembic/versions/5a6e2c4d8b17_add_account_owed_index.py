@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add account owed index
+Revision ID: 5a6e2c4d8b17
+Revises: 3b1f0c7e9a41
+Create Date: 2018-03-26 09:47:52.304117
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5a6e2c4d8b17'
+down_revision = '3b1f0c7e9a41'
+
+
+def upgrade():
+    op.create_index('ix_account_owed_level_owed_at', 'account',
+                    ['owed', 'level', 'owed_at'])
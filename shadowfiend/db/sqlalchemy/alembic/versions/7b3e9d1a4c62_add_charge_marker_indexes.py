@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add charge marker indexes
+Revision ID: 7b3e9d1a4c62
+Revises: 4f7a2b9c5e13
+Create Date: 2018-04-12 16:40:05.118342
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9d1a4c62'
+down_revision = '4f7a2b9c5e13'
+
+
+def upgrade():
+    op.create_index('ix_charge_charge_id', 'charge', ['charge_id'])
+    op.create_index('ix_charge_created_at_id', 'charge', ['created_at', 'id'])
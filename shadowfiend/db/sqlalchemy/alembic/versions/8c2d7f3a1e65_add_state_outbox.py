@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add state outbox
+Revision ID: 8c2d7f3a1e65
+Revises: 5a6e2c4d8b17
+Create Date: 2018-04-02 11:18:40.671209
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c2d7f3a1e65'
+down_revision = '5a6e2c4d8b17'
+
+
+def upgrade():
+    op.create_table(
+        'state_outbox',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_id', sa.String(255)),
+        sa.Column('state', sa.DateTime),
+
+        sa.Column('created_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='UTF8'
+    )
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add lookup indexes
+Revision ID: 9e4b1d6f2c38
+Revises: 8c2d7f3a1e65
+Create Date: 2018-04-09 14:02:13.518946
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1d6f2c38'
+down_revision = '8c2d7f3a1e65'
+
+
+def upgrade():
+    op.create_index('ix_charge_user_id_charge_time', 'charge',
+                    ['user_id', 'charge_time'])
+    op.create_index('ix_charge_charge_time', 'charge', ['charge_time'])
+    op.create_index('ix_account_deleted_owed_updated_at', 'account',
+                    ['deleted', 'owed', 'updated_at'])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add project state
+Revision ID: d8f5d61a2234
+Revises: 6d356e9164d3
+Create Date: 2018-03-12 10:21:37.118472
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd8f5d61a2234'
+down_revision = '6d356e9164d3'
+
+
+def upgrade():
+    op.create_table(
+        'project_state',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('project_id', sa.String(255), index=True, unique=True),
+        sa.Column('state', sa.DateTime),
+
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('updated_at', sa.DateTime),
+
+        mysql_engine='InnoDB',
+        mysql_charset='UTF8'
+    )
@@ -28,19 +28,26 @@ from oslo_utils import uuidutils
 
 from shadowfiend.common import context as shadow_context
 from shadowfiend.common import exception
+from shadowfiend.common import timeutils as shadow_timeutils
 from shadowfiend.common import utils
 from shadowfiend.db import api
 from shadowfiend.db import models as db_models
 from shadowfiend.db.sqlalchemy import migration
 from shadowfiend.db.sqlalchemy import models as sa_models
 
+from sqlalchemy import and_
 from sqlalchemy import asc
+from sqlalchemy import case
 from sqlalchemy import desc
 from sqlalchemy import func
+from sqlalchemy import or_
 from sqlalchemy.orm.exc import NoResultFound
 
 LOG = log.getLogger(__name__)
 CONF = cfg.CONF
+CONF.import_opt('cloudkitty_period',
+                'shadowfiend.processor.config',
+                group='processor')
 
 _FACADE = None
 
@@ -117,7 +124,12 @@ def model_query(context, model, *args, **kwargs):
 
 
 def paginate_query(context, model, limit=None, offset=None,
-                   sort_key=None, sort_dir=None, query=None):
+                   sort_key=None, sort_dir=None, query=None, marker=None):
+    """Return a page of the rows of a query.
+
+    :param marker: the last row of the previous page, the page starts right
+                   after it in the sort order, whatever its depth
+    """
     if not query:
         query = model_query(context, model)
     sort_keys = ['id']
@@ -130,12 +142,12 @@ def paginate_query(context, model, limit=None, offset=None,
         if k and k not in sort_keys:
             sort_keys.insert(0, k)
     query = _paginate_query(query, model, limit, sort_keys,
-                            offset=offset, sort_dir=sort_dir)
+                            offset=offset, sort_dir=sort_dir, marker=marker)
     return query.all()
 
 
 def _paginate_query(query, model, limit, sort_keys, offset=None,
-                    sort_dir=None, sort_dirs=None):
+                    sort_dir=None, sort_dirs=None, marker=None):
     if 'id' not in sort_keys:
         # TODO(justinsb): If this ever gives a false-positive, check
         # the actual primary key, rather than assuming its id
@@ -169,6 +181,22 @@ def _paginate_query(query, model, limit, sort_keys, offset=None,
             raise exception.Invalid()
         query = query.order_by(sort_dir_func(sort_key_attr))
 
+    # Seek past the marker: the rows whose sort keys come after the ones of
+    # the marker, so that deep pages are read from the indexes like the
+    # first one.
+    if marker is not None:
+        criteria = []
+        for i, (sort_key, sort_dir) in enumerate(zip(sort_keys, sort_dirs)):
+            clauses = [getattr(model, key) == getattr(marker, key)
+                       for key in sort_keys[:i]]
+            sort_key_attr = getattr(model, sort_key)
+            if sort_dir == 'desc':
+                clauses.append(sort_key_attr < getattr(marker, sort_key))
+            else:
+                clauses.append(sort_key_attr > getattr(marker, sort_key))
+            criteria.append(and_(*clauses))
+        query = query.filter(or_(*criteria))
+
     if offset is not None:
         query = query.offset(offset)
 
@@ -305,6 +333,12 @@ class Connection(api.Connection):
                                    expired_at=row.expired_at,
                                    remarks=row.remarks)
 
+    def _get_marker(self, model, **filters):
+        marker = get_session().query(model).filter_by(**filters).first()
+        if marker is None:
+            raise exception.MarkerNotFound(marker=filters.values()[0])
+        return marker
+
     def _update_params(self, query, ref, filters,
                        params, failed_exception):
         update_filters = {}
@@ -387,7 +421,12 @@ class Connection(api.Connection):
 
     def get_accounts(self, context, user_id=None, read_deleted=False,
                      owed=None, limit=None, offset=None,
-                     sort_key=None, sort_dir=None, active_from=None):
+                     sort_key=None, sort_dir=None, active_from=None,
+                     marker=None):
+        """Get a page of accounts.
+
+        :param marker: the user_id of the last account of the previous page
+        """
         query = get_session().query(sa_models.Account)
         if owed is not None:
             query = query.filter_by(owed=owed)
@@ -398,10 +437,12 @@ class Connection(api.Connection):
         if not read_deleted:
             query = query.filter_by(deleted=False)
 
+        if marker:
+            marker = self._get_marker(sa_models.Account, user_id=marker)
         result = paginate_query(context, sa_models.Account,
                                 limit=limit, offset=offset,
                                 sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
+                                query=query, marker=marker)
 
         accounts = []
         for r in result:
@@ -409,6 +450,26 @@ class Connection(api.Connection):
             accounts.append(self._row_to_db_account_model(r).__dict__)
         return accounts
 
+    def get_expired_owed_accounts(self, context, max_level=9):
+        """Get the owed accounts whose grace period is over.
+
+        An account of level N may stay owed N days, the accounts of
+        max_level never expire.
+        """
+        now = timeutils.utcnow()
+        query = get_session().query(sa_models.Account).\
+            filter_by(owed=True, deleted=False).\
+            filter(or_(*[and_(sa_models.Account.level == level,
+                              sa_models.Account.owed_at <
+                              now - datetime.timedelta(days=level))
+                         for level in range(max_level)]))
+
+        accounts = []
+        for r in query.all():
+            self._transfer(r)
+            accounts.append(self._row_to_db_account_model(r).__dict__)
+        return accounts
+
     def get_accounts_count(self, context, read_deleted=False,
                            user_id=None, owed=None, active_from=None):
         query = get_session().query(
@@ -488,63 +549,324 @@ class Connection(api.Connection):
 
         session = get_session()
         with session.begin():
-            account = model_query(
-                context,
-                sa_models.Account,
-                session=session).filter_by(user_id=user_id).one()
-            balance = account.balance - quantize(consumption)
-            params = dict(balance=balance,
-                          consumption=quantize(consumption),
-                          updated_at=datetime.datetime.utcnow())
-            if balance < 0:
-                params.update(owed=True, owed_at=datetime.datetime.utcnow())
-            filters = params.keys()
-            filters.append('user_id')
-            self._update_params(model_query(context,
-                                            sa_models.Account,
-                                            session=session),
-                                account, filters, params,
-                                exception.AccountUpdateFailed())
-            # Update project
-            project = model_query(
-                context, sa_models.Project, session=session).\
-                filter_by(project_id=project_id).\
-                one()
-            prj_consumption = project.consumption + quantize(consumption)
-            params = dict(consumption=prj_consumption,
-                          updated_at=timeutils.utcnow())
-            filters = params.keys()
-            filters.append('project_id')
-            self._update_params(model_query(context,
-                                            sa_models.Project,
-                                            session=session),
-                                project, filters, params,
-                                exception.ProjectUpdateFailed())
+            self._debit(context, session, [dict(user_id=user_id,
+                                                project_id=project_id,
+                                                consumption=consumption)])
 
-            # Update relation
-            user_project = model_query(
-                context, sa_models.UsrPrjRelation, session=session).\
-                filter_by(user_id=user_id).\
+    @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
+    def bill_project(self, context, user_id, project_id, consumption, begin,
+                     state, outbox=True):
+        """Debit a billed window and advance the project state at once.
+
+        The window goes from its first period begin to its last one state,
+        it is only billed when it directly follows the stored state, so a
+        window built from a stale state is never billed twice.
+
+        A state outbox row is added in the same transaction, the state is
+        mirrored to gnocchi from it later on. Bulk writers only add it with
+        their last call, passing outbox=False before.
+
+        :returns: False if the window was not billed, else True
+        """
+        session = get_session()
+        with session.begin():
+            if not self._update_state(context, session, project_id,
+                                      begin, state):
+                return False
+            self._debit(context, session, [dict(user_id=user_id,
+                                                project_id=project_id,
+                                                consumption=consumption)])
+            if outbox:
+                session.add(sa_models.StateOutbox(
+                    project_id=project_id,
+                    state=shadow_timeutils.ts2dt(state)))
+        return True
+
+    def get_state_outbox(self, context, limit=None):
+        query = get_session().query(sa_models.StateOutbox).\
+            order_by(sa_models.StateOutbox.id)
+        if limit:
+            query = query.limit(limit)
+        return [dict(id=r.id,
+                     project_id=r.project_id,
+                     state=shadow_timeutils.dt2ts(r.state))
+                for r in query.all()]
+
+    def delete_state_outbox(self, context, ids):
+        if not ids:
+            return
+        session = get_session()
+        with session.begin():
+            session.query(sa_models.StateOutbox).\
+                filter(sa_models.StateOutbox.id.in_(ids)).\
+                delete(synchronize_session=False)
+
+    @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
+    def _bill_projects(self, context, items):
+        """Bill many projects in one transaction.
+
+        Like bill_project, a window is only billed when its first period
+        directly follows the stored state.
+
+        :returns: the ids of the billed projects, the others were already
+                  billed or stale
+        """
+        now = timeutils.utcnow()
+        period = CONF.processor.cloudkitty_period
+        state = sa_models.ProjectState
+        session = get_session()
+        with session.begin():
+            states = dict(session.query(state.project_id, state.state).
+                          filter(state.project_id.in_(
+                              [item['project_id'] for item in items])))
+            items = [dict(item,
+                          state=shadow_timeutils.ts2dt(item['period']),
+                          previous=shadow_timeutils.ts2dt(
+                              item['begin'] - period))
+                     for item in items]
+            to_bill = []
+            for item in items:
+                if item['project_id'] in states and (
+                        states[item['project_id']] != item['previous']):
+                    LOG.warning('The window %s-%s of project %s does not '
+                                'follow its state, it was already billed or '
+                                'is stale' % (item['begin'], item['period'],
+                                              item['project_id']))
+                    continue
+                to_bill.append(item)
+            if not to_bill:
+                return set()
+
+            advanced = [item for item in to_bill
+                        if item['project_id'] in states]
+            if advanced:
+                new_state = case(value=state.project_id, whens=dict(
+                    (item['project_id'], item['state'])
+                    for item in advanced))
+                previous_state = case(value=state.project_id, whens=dict(
+                    (item['project_id'], item['previous'])
+                    for item in advanced))
+                rows_update = session.query(state).\
+                    filter(state.project_id.in_(
+                        [item['project_id'] for item in advanced])).\
+                    filter(state.state == previous_state).\
+                    update({state.state: new_state, state.updated_at: now},
+                           synchronize_session=False)
+                if rows_update != len(advanced):
+                    LOG.debug('A project state was updated in a concurrent '
+                              'transaction, we will bill again')
+                    raise db_exc.RetryRequest(exception.ProjectUpdateFailed())
+            for item in to_bill:
+                if item['project_id'] not in states:
+                    session.add(state(project_id=item['project_id'],
+                                      state=item['state']))
+            self._debit(context, session, to_bill)
+            for item in to_bill:
+                session.add(sa_models.StateOutbox(
+                    project_id=item['project_id'], state=item['state']))
+        return set(item['project_id'] for item in to_bill)
+
+    def update_accounts(self, context, items, chunk_size=500):
+        """Bill many projects, chunk_size of them per transaction.
+
+        The debits of a chunk are grouped in one UPDATE statement per
+        table. A chunk failing is billed again project by project, so that
+        only the faulty projects fail.
+
+        :param items: dicts with the user_id, project_id, consumption, begin
+                      and period (the first and last billed ones) of a
+                      project, one per project
+        :returns: a dict per item with the project_id, billed (False when
+                  the period was already billed) and error
+        """
+        results = []
+        for index in range(0, len(items), chunk_size):
+            chunk = items[index:index + chunk_size]
+            try:
+                billed = self._bill_projects(context, chunk)
+            except Exception as e:
+                LOG.warning('Fail to bill %d projects at once, billing them '
+                            'one by one: %s' % (len(chunk), e))
+            else:
+                results.extend(dict(project_id=item['project_id'],
+                                    billed=item['project_id'] in billed,
+                                    error=None)
+                               for item in chunk)
+                continue
+            for item in chunk:
+                result = dict(project_id=item['project_id'], billed=False,
+                              error=None)
+                try:
+                    result['billed'] = self.bill_project(
+                        context, item['user_id'], item['project_id'],
+                        item['consumption'], item['begin'], item['period'])
+                except Exception as e:
+                    LOG.error('Fail to bill project %s: %s' %
+                              (item['project_id'], e))
+                    result['error'] = str(e)
+                results.append(result)
+        return results
+
+    def _debit(self, context, session, items):
+        """Debit accounts and add consumptions to their projects.
+
+        The amounts are computed by the database, one UPDATE statement per
+        table whatever the number of items, so concurrent debits and
+        charges of the same account never conflict. An account becomes
+        owed when its balance goes negative, owed_at is only set by the
+        debit making it owed.
+
+        :param items: dicts with a user_id, project_id and consumption
+        """
+        amounts = {}
+        project_amounts = {}
+        relation_amounts = {}
+        for item in items:
+            consumption = quantize(item['consumption'])
+            amounts[item['user_id']] = (
+                amounts.get(item['user_id'], 0) + consumption)
+            project_amounts[item['project_id']] = (
+                project_amounts.get(item['project_id'], 0) + consumption)
+            key = (item['user_id'], item['project_id'])
+            relation_amounts[key] = relation_amounts.get(key, 0) + consumption
+        now = datetime.datetime.utcnow()
+
+        account = sa_models.Account
+        consumption = case(value=account.user_id, whens=amounts)
+        owing = account.balance < consumption
+        # NOTE: MySQL evaluates the assignments in order, using the values
+        # already assigned, so balance and owed are assigned last.
+        rows_update = model_query(context, account, session=session).\
+            filter(account.user_id.in_(list(amounts))).\
+            update([(account.owed_at,
+                     case([(and_(owing, account.owed.isnot(True)), now)],
+                          else_=account.owed_at)),
+                    (account.owed, case([(owing, True)],
+                                        else_=account.owed)),
+                    (account.balance, account.balance - consumption),
+                    (account.consumption,
+                     func.coalesce(account.consumption, 0) + consumption),
+                    (account.updated_at, now)],
+                   synchronize_session=False,
+                   update_args={'preserve_parameter_order': True})
+        if rows_update != len(amounts):
+            raise exception.AccountNotFound(user_id=', '.join(amounts))
+
+        project = sa_models.Project
+        consumption = case(value=project.project_id, whens=project_amounts)
+        rows_update = model_query(context, project, session=session).\
+            filter(project.project_id.in_(list(project_amounts))).\
+            update({project.consumption: project.consumption + consumption,
+                    project.updated_at: now},
+                   synchronize_session=False)
+        if rows_update != len(project_amounts):
+            raise exception.ProjectNotFound(
+                project_id=', '.join(project_amounts))
+
+        relation = sa_models.UsrPrjRelation
+        matches = [(and_(relation.user_id == user_id,
+                         relation.project_id == project_id), amount)
+                   for (user_id, project_id), amount
+                   in relation_amounts.items()]
+        consumption = case(matches)
+        rows_update = model_query(context, relation, session=session).\
+            filter(or_(*[match for match, amount in matches])).\
+            update({relation.consumption: relation.consumption + consumption,
+                    relation.updated_at: now},
+                   synchronize_session=False)
+        if rows_update != len(relation_amounts):
+            user_ids, project_ids = zip(*relation_amounts)
+            raise exception.UserProjectNotFound(
+                user_id=', '.join(user_ids), project_id=', '.join(project_ids))
+
+    def _update_state(self, context, session, project_id, begin, state):
+        """Advance the state of a project over the window begin..state.
+
+        :returns: False if the stored state is not the period right before
+                  begin, the window was then already billed or is stale
+        """
+        state_at = shadow_timeutils.ts2dt(state)
+        previous_at = shadow_timeutils.ts2dt(
+            begin - CONF.processor.cloudkitty_period)
+        try:
+            project_state = model_query(
+                context, sa_models.ProjectState, session=session).\
                 filter_by(project_id=project_id).\
                 one()
-            usr_prj_consumption = user_project.consumption + quantize(
-                consumption)
-            params = dict(consumption=usr_prj_consumption,
-                          updated_at=timeutils.utcnow())
-            filters = params.keys()
-            filters.append('user_id')
-            filters.append('project_id')
-            self._update_params(model_query(context,
-                                            sa_models.UsrPrjRelation,
-                                            session=session),
-                                user_project, filters, params,
-                                exception.UserProjectUpdateFailed())
+        except NoResultFound:
+            session.add(sa_models.ProjectState(project_id=project_id,
+                                               state=state_at))
+            return True
+        if project_state.state != previous_at:
+            LOG.warning('The window %s-%s of project %s does not follow its '
+                        'state %s, it was already billed or is stale' %
+                        (begin, state, project_id,
+                         shadow_timeutils.dt2ts(project_state.state)))
+            return False
+        params = dict(state=state_at,
+                      updated_at=timeutils.utcnow())
+        filters = params.keys()
+        filters.append('project_id')
+        self._update_params(model_query(context,
+                                        sa_models.ProjectState,
+                                        session=session),
+                            project_state, filters, params,
+                            exception.ProjectUpdateFailed())
+        return True
+
+    def get_states(self, context, project_ids=None):
+        query = get_session().query(sa_models.ProjectState)
+        if project_ids:
+            query = query.filter(
+                sa_models.ProjectState.project_id.in_(project_ids))
+        return dict((r.project_id, shadow_timeutils.dt2ts(r.state))
+                    for r in query.all())
+
+    def get_teardown_actions(self, context, project_id):
+        query = get_session().query(sa_models.TeardownAction).\
+            filter_by(project_id=project_id)
+        return [dict(resource_id=r.resource_id,
+                     service=r.service,
+                     status=r.status,
+                     updated_at=shadow_timeutils.dt2ts(r.updated_at))
+                for r in query.all()]
 
-    def get_charges(self, context, user_id=None, project_id=None, type=None,
-                    start_time=None, end_time=None,
-                    limit=None, offset=None, sort_key=None, sort_dir=None):
-        query = get_session().query(sa_models.Charge)
+    @oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
+    def set_teardown_actions(self, context, project_id, actions):
+        """Record the status of the teardown of some resources.
+
+        An action is identified by the project, service and resource_id.
 
+        :param actions: list of dicts with resource_id, service and status
+        """
+        if not actions:
+            return
+        session = get_session()
+        with session.begin():
+            now = timeutils.utcnow()
+            resource_ids = [action['resource_id'] for action in actions]
+            rows = dict(
+                ((r.service, r.resource_id), r) for r in
+                model_query(context, sa_models.TeardownAction,
+                            session=session).
+                filter_by(project_id=project_id).
+                filter(sa_models.TeardownAction.resource_id.in_(
+                    resource_ids)).all())
+            for action in actions:
+                key = (action['service'], action['resource_id'])
+                row = rows.get(key)
+                if row is None:
+                    row = sa_models.TeardownAction(
+                        project_id=project_id,
+                        resource_id=action['resource_id'],
+                        service=action['service'])
+                    session.add(row)
+                    rows[key] = row
+                row.status = action['status']
+                row.updated_at = now
+
+    def _filter_charges(self, query, user_id=None, project_id=None,
+                        type=None, start_time=None, end_time=None):
         if project_id:
             query = query.filter_by(project_id=project_id)
 
@@ -557,11 +879,27 @@ class Connection(api.Connection):
         if all([start_time, end_time]):
             query = query.filter(sa_models.Charge.charge_time >= start_time,
                                  sa_models.Charge.charge_time < end_time)
+        return query
 
+    def get_charges(self, context, user_id=None, project_id=None, type=None,
+                    start_time=None, end_time=None,
+                    limit=None, offset=None, sort_key=None, sort_dir=None,
+                    marker=None):
+        """Get a page of charges.
+
+        :param marker: the charge_id of the last charge of the previous page
+        """
+        query = self._filter_charges(get_session().query(sa_models.Charge),
+                                     user_id=user_id, project_id=project_id,
+                                     type=type, start_time=start_time,
+                                     end_time=end_time)
+
+        if marker:
+            marker = self._get_marker(sa_models.Charge, charge_id=marker)
         result = paginate_query(context, sa_models.Charge,
                                 limit=limit, offset=offset,
                                 sort_key=sort_key, sort_dir=sort_dir,
-                                query=query)
+                                query=query, marker=marker)
 
         charges = []
         for r in result:
@@ -572,26 +910,32 @@ class Connection(api.Connection):
     def get_charges_price_and_count(self, context, user_id=None,
                                     project_id=None, type=None,
                                     start_time=None, end_time=None):
-        query = get_session().query(
-            sa_models.Charge,
-            func.count(sa_models.Charge.id).label('count'),
-            func.sum(sa_models.Charge.value).label('sum'))
-
-        if project_id:
-            query = query.filter_by(project_id=project_id)
-
-        if user_id:
-            query = query.filter_by(user_id=user_id)
-
-        if type:
-            query = query.filter_by(type=type)
-
-        if all([start_time, end_time]):
-            query = query.filter(sa_models.Charge.charge_time >= start_time,
-                                 sa_models.Charge.charge_time < end_time)
-
-        return (self._transfer_decimal2float(query.one().sum) or 0,
-                query.one().count or 0)
+        query = self._filter_charges(
+            get_session().query(
+                func.count(sa_models.Charge.id).label('count'),
+                func.sum(sa_models.Charge.value).label('sum')),
+            user_id=user_id, project_id=project_id, type=type,
+            start_time=start_time, end_time=end_time)
+        totals = query.one()
+        return (self._transfer_decimal2float(totals.sum) or 0,
+                totals.count or 0)
+
+    def get_charges_with_totals(self, context, user_id=None,
+                                project_id=None, type=None,
+                                start_time=None, end_time=None, **kwargs):
+        """Get a page of charges and the totals of all the charges.
+
+        :param kwargs: the pagination parameters of get_charges
+        :returns: a dict with the charges, total_price and total_count
+        """
+        filters = dict(user_id=user_id, project_id=project_id, type=type,
+                       start_time=start_time, end_time=end_time)
+        total_price, total_count = self.get_charges_price_and_count(
+            context, **filters)
+        return dict(charges=self.get_charges(context, **dict(filters,
+                                                             **kwargs)),
+                    total_price=total_price,
+                    total_count=total_count)
 
     def create_project(self, context, project):
         session = get_session()
@@ -20,7 +20,7 @@ SQLAlchemy models for Shadowfiend data
 import urlparse
 
 from oslo_config import cfg
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Index, Integer, String
 from sqlalchemy import DateTime, DECIMAL, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -60,7 +60,7 @@ class Account(Base):
     __tablename__ = 'account'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(255))
+    user_id = Column(String(255), index=True, unique=True)
     domain_id = Column(String(255))
     balance = Column(DECIMAL(20, 4))
     consumption = Column(DECIMAL(20, 4))
@@ -74,13 +74,19 @@ class Account(Base):
     deleted_at = Column(DateTime)
 
 
+Index('ix_account_owed_level_owed_at',
+      Account.owed, Account.level, Account.owed_at)
+Index('ix_account_deleted_owed_updated_at',
+      Account.deleted, Account.owed, Account.updated_at)
+
+
 class Project(Base):
 
     __tablename__ = 'project'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(255))
-    project_id = Column(String(255))
+    user_id = Column(String(255), index=True)
+    project_id = Column(String(255), index=True, unique=True)
     consumption = Column(DECIMAL(20, 4))
     domain_id = Column(String(255))
 
@@ -93,8 +99,8 @@ class UsrPrjRelation(Base):
     __tablename__ = 'usr_prj_relation'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(255))
-    project_id = Column(String(255))
+    user_id = Column(String(255), index=True)
+    project_id = Column(String(255), index=True)
     consumption = Column(DECIMAL(20, 4))
     domain_id = Column(String(255))
 
@@ -120,3 +126,50 @@ class Charge(Base):
 
     created_at = Column(DateTime, default=timeutils.utcnow)
     updated_at = Column(DateTime)
+
+
+Index('ix_charge_user_id_charge_time', Charge.user_id, Charge.charge_time)
+Index('ix_charge_charge_time', Charge.charge_time)
+Index('ix_charge_charge_id', Charge.charge_id)
+Index('ix_charge_created_at_id', Charge.created_at, Charge.id)
+
+
+class ProjectState(Base):
+
+    __tablename__ = 'project_state'
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(String(255), index=True, unique=True)
+    state = Column(DateTime)
+
+    created_at = Column(DateTime, default=timeutils.utcnow)
+    updated_at = Column(DateTime, default=timeutils.utcnow)
+
+
+class StateOutbox(Base):
+
+    __tablename__ = 'state_outbox'
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(String(255))
+    state = Column(DateTime)
+
+    created_at = Column(DateTime, default=timeutils.utcnow)
+
+
+class TeardownAction(Base):
+
+    __tablename__ = 'teardown_action'
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(String(255), index=True)
+    resource_id = Column(String(255))
+    service = Column(String(64))
+    status = Column(String(16))
+
+    created_at = Column(DateTime, default=timeutils.utcnow)
+    updated_at = Column(DateTime, default=timeutils.utcnow)
+
+
+Index('uq_teardown_action_resource', TeardownAction.project_id,
+      TeardownAction.service, TeardownAction.resource_id, unique=True)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""API for notifying the shadowfiend processors."""
+from oslo_config import cfg
+
+from shadowfiend.common import service as rpc_service
+
+
+class API(rpc_service.API):
+    def __init__(self, transport=None, context=None, topic=None):
+        if topic is None:
+            cfg.CONF.import_opt('topic', 'shadowfiend.processor.config',
+                                group='processor')
+            topic = cfg.CONF.processor.topic
+        super(API, self).__init__(transport, context, topic=topic)
+
+    def _fanout(self, context, method, **kwargs):
+        self._client.prepare(fanout=True).cast(
+            context or self._context, method, **kwargs)
+
+    def billing_owner_changed(self, context, project_id, user_id):
+        """Tell every processor the billing owner of a project changed"""
+        kwargs = dict(project_id=project_id,
+                      user_id=user_id)
+        return self._fanout(context, 'billing_owner_changed', **kwargs)
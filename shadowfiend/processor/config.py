@@ -38,6 +38,23 @@ SERVICE_OPTS = [
                secret=True,
                help='Coordination driver URL',
                default='file:///var/lib/shadowfiend/locks'),
+    cfg.IntOpt('heartbeat_interval',
+               default=10,
+               help=('Seconds between two heartbeats of the processor to '
+                     'the coordination backend, they are sent in the '
+                     'background and refresh the leases of the held '
+                     'locks.')),
+    cfg.BoolOpt('hold_locks',
+                default=False,
+                help=('Keep the project locks once acquired, as long as the '
+                      'projects are billed by this processor, instead of '
+                      'taking and releasing them for every billed period. '
+                      'The held locks are released when the project moves '
+                      'to another processor or on stop, so it is ignored '
+                      'unless partitioned is set. With the drivers having '
+                      'leases, they are refreshed by the heartbeats; the '
+                      'file driver has none and keeps the locks of a '
+                      'processor until it stops.')),
     cfg.IntOpt('cloudkitty_period',
                default=3600,
                help=('cloudkitty period in seconds.')),
@@ -53,6 +70,131 @@ SERVICE_OPTS = [
     cfg.BoolOpt('historical_expenses',
                 default=False,
                 help="Whether to record the historical cost"),
+    cfg.IntOpt('concurrency',
+               default=16,
+               min=1,
+               help=('Maximum number of projects processed concurrently '
+                     'by one processor worker in a period.')),
+    cfg.BoolOpt('catch_up',
+                default=False,
+                help=('Bill all the pending periods of a lagging project at '
+                      'once instead of one period per lock acquisition.')),
+    cfg.IntOpt('catch_up_max_periods',
+               default=168,
+               min=1,
+               help=('Maximum number of cloudkitty periods billed in one '
+                     'catch-up batch.')),
+    cfg.IntOpt('consume_batch_size',
+               default=100,
+               min=1,
+               help=('Maximum number of projects whose consumption is '
+                     'fetched from gnocchi in one aggregation request, and '
+                     'which are billed in one conductor RPC.')),
+    cfg.StrOpt('rating_archive_policy',
+               default='rating',
+               help=('Archive policy of the cloudkitty total.cost metrics, '
+                     'the consumption is aggregated at one of its '
+                     'granularities.')),
+    cfg.IntOpt('archive_policy_ttl',
+               default=3600,
+               help=('Seconds the granularities read from the rating '
+                     'archive policy are cached.')),
+    cfg.IntOpt('cloudkitty_state_ttl',
+               default=60,
+               help=('Seconds a cloudkitty top watermark read from gnocchi '
+                     'is cached before it is read again.')),
+    cfg.BoolOpt('warm_state_cache',
+                default=True,
+                help=('Load the gnocchi state metric of every project in '
+                      'one search when the processor starts.')),
+    cfg.IntOpt('state_flush_size',
+               default=100,
+               min=1,
+               help=('Number of project states queued before they are '
+                     'written to gnocchi in one batch request.')),
+    cfg.IntOpt('state_flush_interval',
+               default=5,
+               help=('Maximum number of seconds a billed project state '
+                     'stays queued before it is written to gnocchi.')),
+    cfg.IntOpt('outbox_interval',
+               default=10,
+               help=('Seconds between two mirrorings of the billed states '
+                     'from the state outbox to gnocchi.')),
+    cfg.IntOpt('rate_projects_ttl',
+               default=300,
+               min=1,
+               help=('Seconds the rating projects read from keystone are '
+                     'cached. They are refreshed in the background every '
+                     'half of this time.')),
+    cfg.BoolOpt('partitioned',
+                default=False,
+                help=('Join a tooz partitioned group and only bill the '
+                      'share of the projects hashed to this processor.')),
+    cfg.StrOpt('partition_group',
+               default='shadowfiend-processor',
+               help=('Name of the tooz group the processors partition the '
+                     'projects in.')),
+    cfg.IntOpt('retry_delay',
+               default=60,
+               min=1,
+               help=('Seconds before a project that failed to be billed is '
+                     'retried, doubled after each failure.')),
+    cfg.IntOpt('max_retry_delay',
+               default=3600,
+               min=1,
+               help=('Maximum seconds between two retries of a project '
+                     'that failed to be billed.')),
+    cfg.IntOpt('max_attempts',
+               default=10,
+               min=1,
+               help=('Number of failures in a row after which a project is '
+                     'not billed anymore, until the processor restarts. '
+                     'These projects are listed in the guru meditation '
+                     'report.')),
+    cfg.IntOpt('teardown_concurrency',
+               default=4,
+               min=1,
+               help=('Maximum number of resources of an owed project '
+                     'deleted concurrently from each OpenStack service.')),
+    cfg.IntOpt('owed_check_interval',
+               default=300,
+               help=('Seconds between two searches of the owed accounts '
+                     'whose grace period is over.')),
+    cfg.StrOpt('ingestion_mode',
+               default='poll',
+               choices=['poll', 'notification'],
+               help=('How the processor learns about newly rated periods. '
+                     'In notification mode the projects are billed as soon '
+                     'as a rating notification is received, polling only '
+                     'remains as a fallback once per cloudkitty period.')),
+    cfg.ListOpt('notification_topics',
+                default=['notifications'],
+                help=('Topics the rating notifications are listened on in '
+                      'notification mode.')),
+    cfg.StrOpt('notification_pool',
+               default='shadowfiend-processor',
+               help=('Listener pool the processors share, so that each '
+                     'notification is handled by one of them. Partitioned '
+                     'processors each listen in their own pool, named '
+                     'after this one and their host, to all get every '
+                     'notification and only handle the ones of their '
+                     'projects.')),
+    cfg.ListOpt('rating_event_types',
+                default=['rating.processed', 'rating.state.*'],
+                help=('Event types, shell-style wildcards allowed, of the '
+                      'notifications telling a project has new rated '
+                      'data.')),
+    cfg.IntOpt('teardown_action_timeout',
+               default=3600,
+               help=('Seconds after which the deletion of a resource that '
+                     'is still recorded as pending or in-flight is '
+                     'considered interrupted and retried.')),
+    cfg.StrOpt('stats_file',
+               help=('File the processor run stats are written to as JSON '
+                     'at the end of each period: the lag of the projects '
+                     'behind cloudkitty, the time spent in gnocchi, '
+                     'keystone, RPC and lock waits, and the processed, '
+                     'skipped and failed projects.')),
 ]
 
 
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_log import log
+
+from shadowfiend.processor.service import fetcher
+
+LOG = log.getLogger(__name__)
+
+
+class Handler(object):
+    def billing_owner_changed(self, context, project_id, user_id):
+        LOG.debug('Processor Function: billing_owner_changed.')
+        fetcher.set_billing_owners({project_id: user_id})
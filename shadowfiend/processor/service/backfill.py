@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log
+from tooz import coordination
+
+from shadowfiend.common import context
+from shadowfiend.processor.service import fetcher
+from shadowfiend.processor.service import service
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+cfg.CONF.import_group('processor', 'shadowfiend.processor.config')
+
+
+class Backfill(object):
+    """Bill the whole rated history of projects in bulk.
+
+    The history is read from gnocchi window periods at a time, each window
+    is debited and advances the project state in one transaction, and the
+    state is only queued for gnocchi with the last window. The projects are
+    backfilled concurrently, under the same locks as the processors.
+    """
+
+    def __init__(self, dbapi, window=720, concurrency=10):
+        self.dbapi = dbapi
+        self.window = window
+        self.concurrency = concurrency
+        self.context = context.make_admin_context(all_tenants=True)
+        self.gnocchi_fetcher = fetcher.GnocchiFetcher()
+        self.coord = coordination.get_coordinator(
+            CONF.processor.coordination_url,
+            str(uuid.uuid4()).encode('ascii'))
+
+    def run(self, project_ids=None):
+        """Backfill projects, all the rating ones by default.
+
+        :returns: a dict mapping each project id to its billed periods
+        """
+        if not project_ids:
+            project_ids = fetcher.KeystoneFetcher().get_rate_projects()
+        owners = dict((project['project_id'], project['user_id'])
+                      for project in self.dbapi.get_projects(self.context))
+        pool = eventlet.GreenPool(self.concurrency)
+        self.coord.start()
+        try:
+            return dict(zip(project_ids, pool.imap(
+                self._backfill_project, project_ids,
+                [owners.get(project_id) for project_id in project_ids])))
+        finally:
+            self.coord.stop()
+
+    def _backfill_project(self, project_id, user_id):
+        if not user_id:
+            LOG.error("There is no billing owner for project %s" % project_id)
+            return 0
+        lock = self.coord.get_lock(service.lock_name(project_id))
+        if not lock.acquire(blocking=False):
+            LOG.warning("Project %s is being billed, skipping it" %
+                        project_id)
+            return 0
+        try:
+            # NOTE: The state is only read once the project is locked, a
+            # processor may have billed it meanwhile.
+            state = self.dbapi.get_states(
+                self.context, project_ids=[project_id]).get(project_id)
+            return self._bill_history(project_id, user_id, state)
+        except Exception:
+            LOG.exception("Fail to backfill project %s" % project_id)
+            return 0
+        finally:
+            lock.release()
+
+    def _bill_history(self, project_id, user_id, state):
+        # NOTE: Like the processor, the first period billed is the one
+        # following the state, or the cloudkitty bottom watermark.
+        if state is None:
+            state = self.gnocchi_fetcher.get_state(
+                project_id, 'shadowfiend', 'top')
+        if not state:
+            state = self.gnocchi_fetcher.get_state(
+                project_id, 'cloudkitty', 'bottom')
+        top = self.gnocchi_fetcher.get_state(project_id, 'cloudkitty', 'top')
+        if not state or not top:
+            return 0
+        period = CONF.processor.cloudkitty_period
+        begin = state + period
+        periods = max((top - begin + period - 1) // period, 0)
+
+        billed = 0
+        while billed < periods:
+            count = min(self.window, periods - billed)
+            consumption = sum(self.gnocchi_fetcher.get_period_consumes(
+                project_id, begin, count))
+            if not self.dbapi.bill_project(
+                    self.context, user_id=user_id, project_id=project_id,
+                    consumption=consumption, begin=begin,
+                    state=begin + (count - 1) * period,
+                    outbox=billed + count == periods):
+                break
+            billed += count
+            begin += count * period
+        LOG.info("Backfilled %d periods of project %s" % (billed, project_id))
+        return billed
@@ -14,7 +14,7 @@
 #    under the License.
 
 import copy
-import six
+import time
 import uuid
 
 from dateutil import parser
@@ -57,38 +57,111 @@ metric_mappings = {
 
 START_TIME = timeutils.str2ts("2010-01-01T00:00:00Z")
 
+# Process wide cache of project_id: (state resource_id, state metric_id)
+_STATE_METRICS = {}
+
+# Process wide cache of project_id: billing owner user_id
+_BILLING_OWNERS = {}
+
+
+def granularity_seconds(granularity):
+    """Convert a gnocchi granularity, like '1 day, 0:00:00', to seconds."""
+    try:
+        return int(float(granularity))
+    except ValueError:
+        pass
+    days = 0
+    if ',' in granularity:
+        days, granularity = granularity.split(',')
+        days = int(days.split()[0])
+    hours, minutes, seconds = granularity.strip().split(':')
+    return (days * 86400 + int(hours) * 3600 + int(minutes) * 60 +
+            int(float(seconds)))
+
+
+def set_billing_owners(billing_owners):
+    """Update the cached billing owners from a project_id: user_id dict."""
+    for project_id, user_id in billing_owners.items():
+        if user_id:
+            _BILLING_OWNERS[project_id] = user_id
+        else:
+            _BILLING_OWNERS.pop(project_id, None)
+
 
 class KeystoneFetcher(KeystoneClient):
     def __init__(self):
         super(KeystoneFetcher, self).__init__()
+        self._rating_ids = None
+        self._rate_projects = None
+        self._rate_projects_at = 0
 
     def get_rate_projects(self):
+        """Return the cached rating projects, read again once stale.
+
+        The cache is normally kept fresh by refresh_rate_projects, so a
+        period does not have to wait for keystone.
+        """
+        if (self._rate_projects is None or
+                time.time() - self._rate_projects_at >=
+                CONF.processor.rate_projects_ttl):
+            try:
+                self.refresh_rate_projects()
+            except Exception as e:
+                if self._rate_projects is None:
+                    raise
+                LOG.warning("Fail to refresh the rating projects, using "
+                            "the cached ones: %s" % e)
+        return list(self._rate_projects)
+
+    def is_rate_project(self, project_id):
+        """Tell from the cache only whether a project is rated."""
+        return project_id in (self._rate_projects or ())
+
+    def refresh_rate_projects(self):
         keystone_version = discover.normalize_version_number('3')
-        auth_dispatch = {(3,): ('project', 'projects', 'list'),
-                         (2,): ('tenant', 'tenants', 'roles_for_user')}
-        for auth_version, auth_version_mapping in six.iteritems(auth_dispatch):
-            if discover.version_match(auth_version, keystone_version):
-                return self._do_get_projects(auth_version_mapping)
-        msg = "Keystone version you've specified is not supported"
-        raise exceptions.VersionNotAvailable(msg)
-
-    def _do_get_projects(self, auth_version_mapping):
-        # project_attr: project,project_attrs: projects,role_func: list
-        project_attr, projects_attr, role_func = auth_version_mapping
-        project_list = getattr(self.ks_client, projects_attr).list()
-        user_list = getattr(self.ks_client.users, 'list')(
-            **{project_attr: project_list[0]})
-        for user in user_list:
-            if user.__dict__['name'] == 'cloudkitty':
-                rating_user = user.id
-                break
-        for project in project_list[:]:
-            roles = getattr(self.ks_client.roles, role_func)(
-                **{'user': rating_user,
-                   project_attr: project})
-            if 'rating' not in [role.name for role in roles]:
-                project_list.remove(project)
-        return [project.id for project in project_list]
+        if not discover.version_match((3,), keystone_version):
+            msg = "Keystone version you've specified is not supported"
+            raise exceptions.VersionNotAvailable(msg)
+        try:
+            projects = self._do_get_projects()
+        except exceptions.NotFound:
+            # NOTE: The cloudkitty user or the rating role may have been
+            # recreated, look their ids up again next time.
+            self._rating_ids = None
+            raise
+        self._rate_projects = projects
+        self._rate_projects_at = time.time()
+        return list(projects)
+
+    def _get_rating_ids(self):
+        if self._rating_ids is None:
+            users = self.ks_client.users.list(name='cloudkitty')
+            roles = self.ks_client.roles.list(name='rating')
+            if not users or not roles:
+                raise exceptions.NotFound(
+                    "The cloudkitty user or the rating role is missing")
+            self._rating_ids = (users[0].id, roles[0].id)
+        return self._rating_ids
+
+    def _do_get_projects(self):
+        rating_user, rating_role = self._get_rating_ids()
+        assignments = self.ks_client.role_assignments.list(
+            user=rating_user, role=rating_role)
+        projects = set()
+        for assignment in assignments:
+            scope = getattr(assignment, 'scope', {})
+            if 'project' in scope:
+                projects.add(scope['project']['id'])
+        return sorted(projects)
+
+    def get_billing_owner(self, project_id):
+        """Return the cached billing owner, keystone is only read on a miss"""
+        user_id = _BILLING_OWNERS.get(project_id)
+        if not user_id:
+            user_id = self.get_rate_user(project_id)
+            if user_id:
+                _BILLING_OWNERS[project_id] = user_id
+        return user_id
 
     def get_rate_user(self, project_id):
         role_id = getattr(self.ks_client.roles, 'list')(
@@ -110,8 +183,86 @@ class GnocchiFetcher(GnocchiClient):
     def __init__(self):
         super(GnocchiFetcher, self).__init__()
         self._period = CONF.processor.cloudkitty_period
+        self._cloudkitty_states = {}
+        self._pending_states = {}
+        self._flushed_at = time.time()
+        self._granularity = None
+
+    def warm_state_cache(self, limit=1000):
+        """Cache the state metrics of every project with a single search."""
+        marker = None
+        while True:
+            resources = self.gnocchi_client.resource.search(
+                resource_type=SHADOWFIEND_STATE_RESOURCE,
+                limit=limit,
+                marker=marker)
+            for resource in resources:
+                metric_id = resource['metrics'].get(SHADOWFIEND_STATE_METRIC)
+                if metric_id:
+                    _STATE_METRICS[resource['project_id']] = (
+                        resource['id'], metric_id)
+            if len(resources) < limit:
+                break
+            marker = resources[-1]['id']
+        LOG.debug("%d state metrics cached" % len(_STATE_METRICS))
+
+    def _get_state_metric(self, project_id):
+        state_metric = _STATE_METRICS.get(project_id)
+        if not state_metric:
+            state_metric = self._lookup_state_metric(project_id)
+            _STATE_METRICS[project_id] = state_metric
+        return state_metric
 
     def set_state(self, project_id, state):
+        measures = [{'timestamp': timeutils.ts2dt(state).isoformat(),
+                     'value': 1}]
+        resource_id, metric_id = self._get_state_metric(project_id)
+        try:
+            self.gnocchi_client.metric.add_measures(metric_id, measures)
+        except (gexceptions.ResourceNotFound, gexceptions.MetricNotFound):
+            LOG.debug("State metric of project %s is gone, looking it up "
+                      "again" % project_id)
+            _STATE_METRICS.pop(project_id, None)
+            resource_id, metric_id = self._get_state_metric(project_id)
+            self.gnocchi_client.metric.add_measures(metric_id, measures)
+
+    def queue_state(self, project_id, state):
+        """Queue a state advance, written later by flush_states.
+
+        Callers must only queue a state once the matching debit is
+        committed, the queue is flushed when it reaches state_flush_size
+        projects or every state_flush_interval seconds.
+        """
+        if state > self._pending_states.get(project_id, 0):
+            self._pending_states[project_id] = state
+        if (len(self._pending_states) >= CONF.processor.state_flush_size or
+                time.time() - self._flushed_at >=
+                CONF.processor.state_flush_interval):
+            self.flush_states()
+
+    def flush_states(self):
+        """Write all the queued states with one batch measures request."""
+        pending, self._pending_states = self._pending_states, {}
+        self._flushed_at = time.time()
+        if not pending:
+            return
+        measures = {}
+        for project_id, state in pending.items():
+            resource_id, metric_id = self._get_state_metric(project_id)
+            measures[metric_id] = [
+                {'timestamp': timeutils.ts2dt(state).isoformat(),
+                 'value': 1}]
+        try:
+            self.gnocchi_client.metric.batch_metrics_measures(measures)
+        except gexceptions.ClientException as e:
+            # NOTE: Some cached metrics may be gone, write the states one
+            # by one so that they are looked up again.
+            LOG.warning("Fail to write %d states in batch, writing them "
+                        "one by one: %s" % (len(pending), e))
+            for project_id, state in pending.items():
+                self.set_state(project_id, state)
+
+    def _lookup_state_metric(self, project_id):
         query = {"=": {"project_id": project_id}}
         # get resource_id, if not, create it
         resources = self.gnocchi_client.resource.search(
@@ -142,11 +293,7 @@ class GnocchiFetcher(GnocchiClient):
             new_metric["resource_id"] = resource_id
             metric = self.gnocchi_client.metric.create(new_metric)
             metric_id = metric['id']
-        # set state: add measures to gnocchi
-        self.gnocchi_client.metric.add_measures(
-            metric_id,
-            [{'timestamp': timeutils.ts2dt(state).isoformat(),
-             'value': 1}])
+        return resource_id, metric_id
 
     def get_state(self, project_id, state_type, order_type):
         query = {"=": {"project_id": project_id}}
@@ -181,30 +328,118 @@ class GnocchiFetcher(GnocchiClient):
                 result = r[-1][0] if order_type == 'top' else r[0][0]
                 return timeutils.dt2ts(parser.parse(result))
 
-    def get_current_consume(self, project_id, start_stamp=None):
-        if not start_stamp:
-            _stamp = self.get_state(project_id, 'shadowfiend', 'top')
-            start_stamp = (_stamp if _stamp is not None else
-                           self.get_state(project_id, 'cloudkitty', 'bottom'))
-        query = {"=": {"project_id": project_id}}
-
-        def aggregate(start_stamp, period, query, granularity):
+    def get_cloudkitty_state(self, project_id, order_type, after=None):
+        """Cached version of get_state for the cloudkitty watermarks.
+
+        The bottom watermark never moves once known. The top watermark only
+        moves forward, so a cached value beyond ``after`` is always good
+        enough, otherwise it is read again once the cache entry is older
+        than cloudkitty_state_ttl seconds.
+        """
+        key = (project_id, order_type)
+        cached = self._cloudkitty_states.get(key)
+        now = time.time()
+        if cached:
+            stamp, fetched_at = cached
+            if stamp is not None and (order_type == 'bottom' or
+                                      (after is not None and stamp > after)):
+                return stamp
+            if now - fetched_at < CONF.processor.cloudkitty_state_ttl:
+                return stamp
+        stamp = self.get_state(project_id, 'cloudkitty', order_type)
+        self._cloudkitty_states[key] = (stamp, now)
+        return stamp
+
+    def _aggregate_consume(self, query, start_stamp, stop_stamp,
+                           groupby=None):
+        def aggregate(granularity):
             return self.gnocchi_client.metric.aggregation(
                 start=start_stamp,
-                stop=((start_stamp + period) if start_stamp is not None
-                      else None),
+                stop=stop_stamp,
                 query=query,
                 metrics='total.cost',
                 aggregation='sum',
-                granularity=granularity)
+                granularity=granularity,
+                groupby=groupby)
         try:
-            current_consume = aggregate(
-                start_stamp, self._period, query, self._period)
-        except Exception:
-            current_consume = aggregate(
-                start_stamp, self._period, query, 86400)
+            granularity = self._get_granularity()
+        except Exception as e:
+            LOG.warning("Fail to read the archive policy %s: %s" %
+                        (CONF.processor.rating_archive_policy, e))
+            try:
+                return aggregate(self._period)
+            except Exception:
+                return aggregate(86400)
+        try:
+            return aggregate(granularity)
+        except gexceptions.BadRequest:
+            # NOTE: The archive policy may have changed, read it again.
+            self._granularity = None
+            return aggregate(self._get_granularity())
+
+    def _get_granularity(self):
+        """Return the granularity the consumption is aggregated at.
+
+        It is the cloudkitty period if the rating archive policy keeps it,
+        else the finest longer one, like the daily one. The periods are then
+        billed the cost of the coarser points starting in them, a warning
+        is logged whenever such a granularity is read.
+        """
+        previous = None
+        if self._granularity:
+            previous, fetched_at = self._granularity
+            if time.time() - fetched_at < CONF.processor.archive_policy_ttl:
+                return previous
+        policy = self.gnocchi_client.archive_policy.get(
+            CONF.processor.rating_archive_policy)
+        granularities = sorted(
+            granularity_seconds(definition['granularity'])
+            for definition in policy['definition'])
+        longer = [g for g in granularities if g >= self._period]
+        granularity = longer[0] if longer else granularities[-1]
+        if granularity != self._period and granularity != previous:
+            LOG.warning("The archive policy %s has no %ss granularity, the "
+                        "consumption is aggregated at %ss and billed with "
+                        "the period its points start in" %
+                        (CONF.processor.rating_archive_policy,
+                         self._period, granularity))
+        self._granularity = (granularity, time.time())
+        return granularity
+
+    def get_current_consume(self, project_id, start_stamp=None):
+        if not start_stamp:
+            _stamp = self.get_state(project_id, 'shadowfiend', 'top')
+            start_stamp = (_stamp if _stamp is not None else
+                           self.get_state(project_id, 'cloudkitty', 'bottom'))
+        query = {"=": {"project_id": project_id}}
+        current_consume = self._aggregate_consume(
+            query, start_stamp,
+            (start_stamp + self._period) if start_stamp is not None
+            else None)
         return current_consume[0][2] if current_consume != [] else 0
 
+    def get_period_consumes(self, project_id, start_stamp, periods):
+        """Return the cost of each period of a window in one request."""
+        query = {"=": {"project_id": project_id}}
+        consumes = self._aggregate_consume(
+            query, start_stamp, start_stamp + periods * self._period)
+        return [consume[2] for consume in consumes]
+
+    def get_projects_consume(self, project_ids, start_stamp, periods=1):
+        """Return the cost of a window for many projects in one request.
+
+        :returns: a dict mapping each project id to its cost
+        """
+        query = {"in": {"project_id": list(project_ids)}}
+        groups = self._aggregate_consume(
+            query, start_stamp, start_stamp + periods * self._period,
+            groupby=['project_id'])
+        consumes = dict.fromkeys(project_ids, 0)
+        for group in groups:
+            consumes[group['group']['project_id']] = sum(
+                measure[2] for measure in group['measures'])
+        return consumes
+
     def get_resource_price(self, metric_id, start=None, stop=None,
                            aggregation='sum', granularity=None):
         _granularity = granularity or self._period
@@ -220,9 +455,12 @@ class GnocchiFetcher(GnocchiClient):
             total_price += measure[2] if measure[1] == _granularity else 0
         return total_price
 
-    def get_resources(self, project_id, service):
+    def get_resources(self, project_id, service, started_after=None):
         query = ({"=": {"project_id": project_id}} if project_id else
                  {">=": {"started_at": "2010-01-01"}})
+        if started_after:
+            query = {"and": [query, {">=": {
+                "started_at": timeutils.ts2dt(started_after).isoformat()}}]}
         try:
             resources = self.gnocchi_client.resource.search(
                 resource_type=service,
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fnmatch
+import oslo_messaging as messaging
+
+from oslo_config import cfg
+from oslo_log import log
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+cfg.CONF.import_group('processor', 'shadowfiend.processor.config')
+cfg.CONF.import_opt('host', 'shadowfiend.common.service')
+
+
+class RatingEndpoint(object):
+    """Hand the projects that got newly rated data to a callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def info(self, ctxt, publisher_id, event_type, payload, metadata):
+        if not any(fnmatch.fnmatch(event_type, pattern)
+                   for pattern in CONF.processor.rating_event_types):
+            return
+        project_id = payload.get('project_id') or payload.get('tenant_id')
+        if not project_id:
+            LOG.warning("No project in the %s notification" % event_type)
+            return
+        LOG.debug("Project %s rated by %s" % (project_id, publisher_id))
+        self.callback(project_id)
+
+
+def get_listener(callback, transport=None, member_id=None):
+    """Return the rating notification listener of a processor.
+
+    :param member_id: name of the processor, the host by default
+    """
+    if transport is None:
+        transport = messaging.get_notification_transport(CONF)
+    targets = [messaging.Target(topic=topic)
+               for topic in CONF.processor.notification_topics]
+    pool = CONF.processor.notification_pool
+    if CONF.processor.partitioned:
+        # NOTE: Partitioned processors only bill their own projects, each
+        # of them listens in its own pool to get every notification.
+        pool = '%s-%s' % (pool, member_id or CONF.host)
+    return messaging.get_notification_listener(
+        transport, targets, [RatingEndpoint(callback)],
+        executor='eventlet', pool=pool)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import heapq
+
+
+class Scheduler(object):
+    """Priority queue of the projects keyed by the time they become due.
+
+    The most lagging projects have the earliest due time, so they are
+    popped first. A project is forgotten once popped, until it is
+    scheduled again.
+
+    Failed projects are retried with an exponential backoff, and moved to
+    the dead letters after max_attempts failures in a row. Dead letters
+    are not scheduled anymore.
+    """
+
+    def __init__(self, retry_delay=60, max_retry_delay=3600,
+                 max_attempts=10):
+        self._queue = []
+        self._due = {}
+        self._failures = {}
+        self.dead_letters = {}
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, project_id):
+        return project_id in self._due
+
+    def schedule(self, project_id, due):
+        self._due[project_id] = due
+        heapq.heappush(self._queue, (due, project_id))
+
+    def sync(self, project_ids, now):
+        """Follow the project list, new projects are due right away."""
+        project_ids = set(project_ids)
+        for project_id in list(self._due):
+            if project_id not in project_ids:
+                del self._due[project_id]
+                self._failures.pop(project_id, None)
+        for project_id in project_ids:
+            if (project_id not in self._due and
+                    project_id not in self.dead_letters):
+                self.schedule(project_id, now)
+
+    def fail(self, project_id, error, now):
+        """Retry a failed project later, or give up on it."""
+        attempts = self._failures.get(project_id, 0) + 1
+        if attempts >= self.max_attempts:
+            self._failures.pop(project_id, None)
+            self._due.pop(project_id, None)
+            self.dead_letters[project_id] = {'attempts': attempts,
+                                             'error': str(error),
+                                             'failed_at': now}
+            return
+        self._failures[project_id] = attempts
+        delay = min(self.retry_delay * 2 ** (attempts - 1),
+                    self.max_retry_delay)
+        self.schedule(project_id, now + delay)
+
+    def succeed(self, project_id):
+        self._failures.pop(project_id, None)
+
+    def retrying(self):
+        """Return the failed projects waiting for a retry with attempts."""
+        return dict(self._failures)
+
+    def next_due(self):
+        while self._queue:
+            due, project_id = self._queue[0]
+            if self._due.get(project_id) == due:
+                return due
+            # Rescheduled or removed project
+            heapq.heappop(self._queue)
+
+    def pop_due(self, now):
+        """Pop the projects due at now, the most lagging first."""
+        projects = []
+        while True:
+            due = self.next_due()
+            if due is None or due > now:
+                return projects
+            due, project_id = heapq.heappop(self._queue)
+            del self._due[project_id]
+            projects.append(project_id)
@@ -16,10 +16,14 @@
 import eventlet
 import functools
 import random
+import time
 import uuid
 
+from eventlet import queue
 from oslo_config import cfg
 from oslo_log import log
+from oslo_reports import guru_meditation_report as gmr
+from oslo_reports.models import with_default_views
 from oslo_service import periodic_task
 
 from shadowfiend.common import context
@@ -27,10 +31,10 @@ from shadowfiend.common import service as rpc_service
 from shadowfiend.common import timeutils
 from shadowfiend.conductor import api as conductor_api
 from shadowfiend.processor.service import fetcher
-from shadowfiend.services import cinder
-from shadowfiend.services import glance
-from shadowfiend.services import neutron
-from shadowfiend.services import nova
+from shadowfiend.processor.service import listener
+from shadowfiend.processor.service import scheduler
+from shadowfiend.processor.service import stats
+from shadowfiend.processor.service import teardown
 
 from tooz import coordination
 
@@ -39,15 +43,13 @@ LOG = log.getLogger(__name__)
 
 cfg.CONF.import_group('processor', 'shadowfiend.processor.config')
 process_period = CONF.processor.process_period
+rate_projects_refresh = max(CONF.processor.rate_projects_ttl // 2, 1)
+owed_check_interval = CONF.processor.owed_check_interval
+outbox_interval = CONF.processor.outbox_interval
 
-TS_DAY = 86400
-service_map = {'computer': nova,
-               'image': glance,
-               'volume.volume': cinder,
-               'volume.snapshot': cinder,
-               'ratelimit.gw': neutron,
-               'ratelimit.fip': neutron,
-               'loadbalancer': neutron}
+
+def lock_name(project_id):
+    return b"shadowfiend-" + str(project_id).encode('ascii')
 
 
 def set_context(func):
@@ -63,6 +65,8 @@ def set_context(func):
 class ProcessorService(rpc_service.Service):
     def __init__(self, *args, **kwargs):
         super(ProcessorService, self).__init__(*args, **kwargs)
+        self._listener = None
+        self._tasks = None
 
     def start(self, *args, **kwargs):
         super(ProcessorService, self).start(*args, **kwargs)
@@ -75,11 +79,31 @@ class ProcessorService(rpc_service.Service):
                 initial_delay = None
 
             pt = ProcessorPeriodTasks(CONF)
+            gmr.TextGuruMeditation.register_section('Billing Failures',
+                                                    pt.failures_report)
+            gmr.TextGuruMeditation.register_section('Billing Stats',
+                                                    pt.stats_report)
             self.tg.add_dynamic_timer(
                 pt.run_periodic_tasks,
                 initial_delay=initial_delay,
                 periodic_interval_max=self.periodic_interval_max,
                 context=None)
+            self.tg.add_timer(CONF.processor.heartbeat_interval,
+                              pt.heartbeat)
+            self._tasks = pt
+
+            if CONF.processor.ingestion_mode == 'notification':
+                self._listener = listener.get_listener(pt.notify_rated)
+                self._listener.start()
+                self.tg.add_thread(pt.ingestion_loop)
+
+    def stop(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener.wait()
+        if self._tasks:
+            self._tasks.release_locks()
+        super(ProcessorService, self).stop()
 
 
 class ProcessorPeriodTasks(periodic_task.PeriodicTasks):
@@ -88,125 +112,466 @@ class ProcessorPeriodTasks(periodic_task.PeriodicTasks):
         # Fetcher init
         self.keystone_fetcher = fetcher.KeystoneFetcher()
         self.gnocchi_fetcher = fetcher.GnocchiFetcher()
+        if CONF.processor.warm_state_cache:
+            try:
+                self.gnocchi_fetcher.warm_state_cache()
+            except Exception as e:
+                LOG.warning("Fail to warm the state cache: %s" % e)
 
         # DLM
         self.coord = coordination.get_coordinator(
             CONF.processor.coordination_url,
             str(uuid.uuid4()).encode('ascii'))
         self.coord.start()
+        self.partitioner = None
+        if CONF.processor.partitioned:
+            self.partitioner = self.coord.join_partitioned_group(
+                CONF.processor.partition_group.encode('ascii'))
         self.conductor = conductor_api.API()
+        self.stats = stats.Stats()
+        self._notified = queue.LightQueue()
+        self.scheduler = scheduler.Scheduler(
+            retry_delay=CONF.processor.retry_delay,
+            max_retry_delay=CONF.processor.max_retry_delay,
+            max_attempts=CONF.processor.max_attempts)
+
+        self._locks = {}
+        self._held = set()
+        if CONF.processor.hold_locks and not CONF.processor.partitioned:
+            LOG.warning("The project locks are not held, hold_locks "
+                        "requires partitioned processors")
+
+        self.teardown = teardown.TeardownEngine(self.gnocchi_fetcher,
+                                                self.conductor)
 
         self.tools = {'conductor': self.conductor,
                       'gnocchi_fetcher': self.gnocchi_fetcher,
-                      'keystone_fetcher': self.keystone_fetcher}
+                      'keystone_fetcher': self.keystone_fetcher,
+                      'stats': self.stats}
 
     def _lock(self, project_id):
-        lock_name = b"shadowfiend-" + str(project_id).encode('ascii')
-        return self.coord.get_lock(lock_name)
+        lock = self._locks.get(project_id)
+        if lock is None:
+            lock = self._locks[project_id] = self.coord.get_lock(
+                lock_name(project_id))
+        return lock
+
+    def _acquire(self, project_id):
+        """Return the lock of a project once acquired, else None."""
+        lock = self._lock(project_id)
+        if project_id in self._held:
+            return lock
+        with self.stats.timer('lock'):
+            acquired = lock.acquire(blocking=False)
+        if not acquired:
+            return None
+        # NOTE: A held lock is only released when its project moves to
+        # another processor, which takes partitioned processors.
+        if CONF.processor.hold_locks and CONF.processor.partitioned:
+            self._held.add(project_id)
+        return lock
+
+    def _release(self, project_id, lock):
+        if project_id not in self._held:
+            lock.release()
+
+    def _forget_locks(self, project_ids):
+        """Drop the locks of the projects not billed here anymore."""
+        project_ids = set(project_ids)
+        for project_id in list(self._locks):
+            if project_id not in project_ids:
+                lock = self._locks.pop(project_id)
+                if project_id in self._held:
+                    self._held.discard(project_id)
+                    lock.release()
+
+    def release_locks(self):
+        self._forget_locks([])
+
+    def heartbeat(self):
+        try:
+            self.coord.heartbeat()
+        except Exception as e:
+            LOG.warning("Fail to heartbeat the coordination backend: %s" % e)
+
+    def _own_projects(self, projects):
+        """Filter out the projects hashed to other processors.
+
+        The project locks are still taken, they protect a project while
+        the members of the group change.
+        """
+        if self.partitioner is None:
+            return projects
+        self.coord.run_watchers()
+        return [project_id for project_id in projects
+                if self.partitioner.belongs_to_self(project_id)]
+
+    def failures_report(self):
+        return with_default_views.ModelWithDefaultViews(data={
+            'retrying': self.scheduler.retrying(),
+            'dead_letters': self.scheduler.dead_letters})
+
+    def stats_report(self):
+        return with_default_views.ModelWithDefaultViews(
+            data=self.stats.report())
 
-    def _check_state(self, project_id):
-        timestamp = self.gnocchi_fetcher.get_state(
-            project_id, 'shadowfiend', 'top')
+    def _fail(self, project_id, error):
+        LOG.error("Fail to bill project %s: %s" % (project_id, error))
+        self.stats.error(project_id, error)
+        self.scheduler.fail(project_id, error, time.time())
+
+    def _reschedule(self, project_id, timestamp, retry=0):
+        """Schedule a project for the period following timestamp.
+
+        The period is billable once cloudkitty rated the one after it. A
+        project whose due time is already past is scheduled retry seconds
+        from now.
+        """
+        period = CONF.processor.cloudkitty_period
+        due = timestamp + 2 * period if timestamp else 0
+        self.scheduler.schedule(project_id, max(due, time.time() + retry))
+
+    def _check_window(self, project_id, timestamp=None):
+        """Return the first pending period and how many can be billed.
+
+        :param timestamp: the last billed period from the local state store,
+                          gnocchi is only read when it is unknown
+        """
+        if timestamp is None:
+            with self.stats.timer('gnocchi'):
+                timestamp = self.gnocchi_fetcher.get_state(
+                    project_id, 'shadowfiend', 'top')
         LOG.debug("timestamp is :%s" % timestamp)
         if not timestamp and CONF.processor.historical_expenses:
             LOG.debug("There is no shadowfiend timestamp"
                       "Initialization from cloudkitty's first record")
-            timestamp = self.gnocchi_fetcher.get_state(
-                project_id, 'cloudkitty', 'bottom')
+            with self.stats.timer('gnocchi'):
+                timestamp = self.gnocchi_fetcher.get_cloudkitty_state(
+                    project_id, 'bottom')
         elif not timestamp:
             LOG.debug("There is no shadowfiend timestamp"
                       "Initialization from current time")
             now_ts = timeutils.utcnow_ts()
             timestamp = now_ts - (now_ts % 3600)
-            return timestamp
+            return timestamp, 1
 
-        top_stamp = self.gnocchi_fetcher.get_state(
-            project_id, 'cloudkitty', 'top')
-        next_timestamp = timestamp + CONF.processor.cloudkitty_period
+        period = CONF.processor.cloudkitty_period
+        next_timestamp = timestamp + period
+        with self.stats.timer('gnocchi'):
+            top_stamp = self.gnocchi_fetcher.get_cloudkitty_state(
+                project_id, 'top', after=next_timestamp)
+        # Seconds of rated data not billed yet
+        self.stats.set_lag(project_id,
+                           max((top_stamp or 0) - next_timestamp, 0))
         if next_timestamp < top_stamp:
-            return next_timestamp
-        return 0
+            if not CONF.processor.catch_up:
+                return next_timestamp, 1
+            lag = (top_stamp - next_timestamp + period - 1) // period
+            return (next_timestamp,
+                    min(lag, CONF.processor.catch_up_max_periods))
+        return 0, 0
+
+    def _lock_window(self, project_id, lock, timestamp=None):
+        """Look up the pending billing window of a locked project.
+
+        :returns: None if it failed, else a (begin, periods) tuple. The lock
+                  is only kept when there is something to bill, begin being
+                  0 otherwise.
+        """
+        try:
+            begin, periods = self._check_window(project_id, timestamp)
+        except Exception as e:
+            self._release(project_id, lock)
+            self._fail(project_id, e)
+            return None
+        if not begin:
+            self._release(project_id, lock)
+            self.stats.count('not_due')
+            return 0, 0
+        return begin, periods
+
+    def _bill_batch(self, ctx, begin, periods, batch):
+        """Bill a batch of locked projects, it never raises.
+
+        The consumption of the batch is fetched in one gnocchi request and
+        the projects are billed in one update_accounts RPC, then scheduled
+        again.
+
+        :returns: the number of billed periods
+        """
+        locks = dict(batch)
+        try:
+            with self.stats.timer('gnocchi'):
+                consumes = self.gnocchi_fetcher.get_projects_consume(
+                    list(locks), begin, periods)
+        except Exception as e:
+            for project_id, lock in batch:
+                self._release(project_id, lock)
+                self._fail(project_id, e)
+            return 0
+
+        bills = []
+        for project_id, lock in batch:
+            try:
+                bills.append(Worker(
+                    ctx, project_id, begin, self.tools, periods=periods,
+                    period_cost=consumes[project_id]).get_bill())
+            except Exception as e:
+                self._release(project_id, lock)
+                self._fail(project_id, e)
+        if not bills:
+            return 0
+        try:
+            with self.stats.timer('rpc'):
+                results = self.conductor.update_accounts(ctx, bills)
+        except Exception as e:
+            results = [dict(project_id=bill['project_id'], billed=False,
+                            error=str(e)) for bill in bills]
+
+        billed = 0
+        for bill, result in zip(bills, results):
+            project_id = bill['project_id']
+            self._release(project_id, locks[project_id])
+            if result['error']:
+                self._fail(project_id, result['error'])
+                continue
+            self.scheduler.succeed(project_id)
+            if result['billed']:
+                self.stats.count('processed')
+                self.stats.count('billed_periods', periods)
+                billed += periods
+            self._reschedule(project_id, bill['period'])
+        return billed
+
+    def _bill_window(self, ctx, pool, begin, periods, locked_projects):
+        """Bill every project due for the same window.
+
+        The projects are billed in batches of consume_batch_size projects,
+        one gnocchi request and one RPC per batch.
+
+        :returns: the number of billed periods
+        """
+        batch_size = CONF.processor.consume_batch_size
+        workers = [pool.spawn(self._bill_batch, ctx, begin, periods,
+                              locked_projects[index:index + batch_size])
+                   for index in range(0, len(locked_projects), batch_size)]
+        return sum(worker.wait() for worker in workers)
+
+    @periodic_task.periodic_task(run_immediately=True,
+                                 spacing=rate_projects_refresh)
+    @set_context
+    def refresh_rate_projects(self, ctx):
+        try:
+            self.keystone_fetcher.refresh_rate_projects()
+        except Exception as e:
+            LOG.warning("Fail to refresh the rating projects: %s" % e)
+        try:
+            projects = self.conductor.get_projects(ctx)
+            fetcher.set_billing_owners(dict(
+                (project['project_id'], project['user_id'])
+                for project in projects))
+        except Exception as e:
+            LOG.warning("Fail to refresh the billing owners: %s" % e)
+
+    def notify_rated(self, project_id):
+        """Bill a project right away, it just got newly rated data."""
+        if (not self.keystone_fetcher.is_rate_project(project_id) or
+                not self._own_projects([project_id])):
+            return
+        self.scheduler.schedule(project_id, time.time())
+        self._notified.put(project_id)
+
+    def ingestion_loop(self):
+        ctx = context.make_admin_context(all_tenants=True)
+        while True:
+            self._notified.get()
+            # The projects notified meanwhile are due too
+            while not self._notified.empty():
+                self._notified.get_nowait()
+            try:
+                self._bill_due(ctx)
+            except Exception:
+                LOG.exception("Fail to bill the notified projects")
+
+    @periodic_task.periodic_task(run_immediately=True,
+                                 spacing=owed_check_interval)
+    @set_context
+    def owed_period(self, ctx):
+        """Drop the resources of the accounts owed for too long."""
+        if not CONF.allow_owe_action:
+            return
+        accounts = self.conductor.get_expired_owed_accounts(ctx)
+        for account in accounts:
+            projects = self.conductor.get_projects(
+                ctx, user_id=account['user_id'])
+            for project_id in self._own_projects(
+                    [project['project_id'] for project in projects]):
+                LOG.info("Account %s is owed since %s, dropping the "
+                         "resources of project %s" %
+                         (account['user_id'], account['owed_at'],
+                          project_id))
+                self.teardown.submit(project_id)
 
     @periodic_task.periodic_task(run_immediately=True, spacing=process_period)
     @set_context
     def primary_period(self, ctx):
+        self.stats.new_period()
         # fetch rating enable projects
-        rate_projects = self.keystone_fetcher.get_rate_projects()
+        with self.stats.timer('keystone'):
+            rate_projects = self.keystone_fetcher.get_rate_projects()
+        rate_projects = self._own_projects(rate_projects)
         LOG.info("projects are %s" % str(rate_projects))
 
-        while len(rate_projects):
-            for rate_project in rate_projects[:]:
-                lock = self._lock(rate_project)
-                if lock.acquire(blocking=False):
-                    begin = self._check_state(rate_project)
-                    if not begin:
-                        rate_projects.remove(rate_project)
-                    else:
-                        worker = Worker(ctx, rate_project, begin, self.tools)
-                        worker.run()
-                    lock.release()
-                self.coord.heartbeat()
-            # NOTE(sheeprine): Slow down looping if all projects are
-            # being processed
-            eventlet.sleep(1)
+        started_at = time.time()
+        project_count = len(rate_projects)
+
+        # NOTE: Projects that are not due yet stay in the scheduler, they
+        # are not looked at until a later period reaches their due time.
+        # Projects locked by another processor are picked up again at the
+        # next period, failed ones once their retry delay is over.
+        self.scheduler.sync(rate_projects, started_at)
+        self._forget_locks(rate_projects)
+        billed = self._bill_due(ctx)
 
-        # check every project's timestamp is prepared, push into thread queue
-        LOG.info("Process successfully in this period")
+        elapsed = time.time() - started_at
+        LOG.info("Process successfully in this period: %(billed)d periods "
+                 "billed for %(projects)d projects in %(elapsed).2fs "
+                 "(%(rate).2f periods/s)" %
+                 {'billed': billed,
+                  'projects': project_count,
+                  'elapsed': elapsed,
+                  'rate': billed / elapsed if elapsed else 0.0})
+        if CONF.processor.stats_file:
+            try:
+                self.stats.dump(CONF.processor.stats_file)
+            except Exception as e:
+                LOG.warning("Fail to write the stats file %s: %s" %
+                            (CONF.processor.stats_file, e))
+
+    def _bill_due(self, ctx):
+        """Bill the projects due in the scheduler until none is left.
+
+        :returns: the number of billed periods
+        """
+        billed = 0
+        pool = eventlet.GreenPool(CONF.processor.concurrency)
+        retry = (CONF.processor.cloudkitty_period
+                 if CONF.processor.ingestion_mode == 'notification'
+                 else process_period)
+        due_projects = self.scheduler.pop_due(time.time())
+        while due_projects:
+            windows = {}
+            locks = list(pool.imap(self._acquire, due_projects))
+            locked_projects = [(due_project, lock) for due_project, lock
+                               in zip(due_projects, locks) if lock]
+            self.stats.count('locked',
+                             len(due_projects) - len(locked_projects))
+            # NOTE: The states are only read once the projects are locked,
+            # a state read before may be billed meanwhile.
+            try:
+                with self.stats.timer('rpc'):
+                    states = self.conductor.get_states(
+                        ctx, project_ids=[due_project for due_project, lock
+                                          in locked_projects])
+            except Exception as e:
+                for due_project, lock in locked_projects:
+                    self._release(due_project, lock)
+                    self._fail(due_project, e)
+                locked_projects = []
+            results = list(pool.imap(
+                self._lock_window,
+                [due_project for due_project, lock in locked_projects],
+                [lock for due_project, lock in locked_projects],
+                [states.get(due_project)
+                 for due_project, lock in locked_projects]))
+            for (due_project, lock), result in zip(locked_projects, results):
+                if result is None:
+                    continue
+                begin, periods = result
+                if not begin:
+                    self._reschedule(due_project, states.get(due_project),
+                                     retry=retry)
+                    continue
+                windows.setdefault((begin, periods), []).append(
+                    (due_project, lock))
+            for (begin, periods), locked_projects in windows.items():
+                billed += self._bill_window(ctx, pool, begin, periods,
+                                            locked_projects)
+            due_projects = self.scheduler.pop_due(time.time())
+        if billed:
+            # NOTE: The periods are billed already, the states left in the
+            # outbox are mirrored by outbox_period.
+            try:
+                self._drain_outbox(ctx)
+            except Exception as e:
+                LOG.warning("Fail to mirror the states to gnocchi: %s" % e)
+        return billed
+
+    def _drain_outbox(self, ctx):
+        """Mirror the billed states of the state outbox to gnocchi.
+
+        The outbox rows are only deleted once gnocchi got the states, a
+        state may be written twice but never lost.
+        """
+        batch_size = CONF.processor.state_flush_size
+        while True:
+            with self.stats.timer('rpc'):
+                rows = self.conductor.get_state_outbox(ctx, limit=batch_size)
+            if not rows:
+                return
+            for row in rows:
+                self.gnocchi_fetcher.queue_state(row['project_id'],
+                                                 row['state'])
+            with self.stats.timer('gnocchi'):
+                self.gnocchi_fetcher.flush_states()
+            with self.stats.timer('rpc'):
+                self.conductor.delete_state_outbox(
+                    ctx, [row['id'] for row in rows])
+            if len(rows) < batch_size:
+                return
+
+    @periodic_task.periodic_task(spacing=outbox_interval)
+    @set_context
+    def outbox_period(self, ctx):
+        try:
+            self._drain_outbox(ctx)
+        except Exception as e:
+            LOG.warning("Fail to mirror the states to gnocchi: %s" % e)
 
 
 class Worker(object):
-    def __init__(self, context, project_id, begin, tools):
+    def __init__(self, context, project_id, begin, tools, periods,
+                 period_cost):
         self.context = context
         self.project_id = project_id
         self.begin = begin
+        self.periods = periods
+        self.period_cost = period_cost
 
         self.conductor = tools['conductor']
         self.gnocchi_fetcher = tools['gnocchi_fetcher']
         self.keystone_fetcher = tools['keystone_fetcher']
+        self.stats = tools.get('stats') or stats.Stats()
 
-    def run(self):
-        period_cost = self.gnocchi_fetcher.get_current_consume(
-            self.project_id, self.begin)
+    def get_bill(self):
+        """Return the billing of the project window for update_accounts.
+
+        The consumption of the window, period_cost, is fetched beforehand
+        for the whole batch.
+        """
         # get billing owner
-        rate_user_id = self.keystone_fetcher.get_rate_user(
-            self.project_id)
+        with self.stats.timer('keystone'):
+            rate_user_id = self.keystone_fetcher.get_billing_owner(
+                self.project_id)
         if rate_user_id == []:
             LOG.error("There is no billing owner in you project: %s "
                       "Please contact the administrator" % self.project_id)
             raise ValueError("Not Found rate_user_id")
-        try:
-            account = self.conductor.get_account(
-                self.context, rate_user_id)
-        except Exception as e:
-            LOG.error("Account: %s need to be registered to the "
-                      "shadowfiend's database. The reason is: %s" %
-                      (rate_user_id, e))
-            raise
-        if account['owed']:
-            owed_offset = (timeutils.utcnow_ts() -
-                           timeutils.str2ts(account['owed_at']))
-            if (owed_offset <= account['level'] * TS_DAY or
-                    account['level'] == 9 or not CONF.allow_owe_action):
-                pass
-            else:
-                self.owed_action(self.project_id)
-        self.conductor.update_account(
-            self.context,
-            user_id=rate_user_id,
-            project_id=self.project_id,
-            consumption=period_cost)
-        self.gnocchi_fetcher.set_state(self.project_id, self.begin)
-
-    def owed_action(self, project_id):
-        # get billing resource
-        for _service in CONF.processor.services:
-            try:
-                resources = self.gnocchi_fetcher.get_resources(_service,
-                                                               project_id)
-                for resource in resources:
-                    service_map[_service].drop_resource(_service,
-                                                        resource['id'])
-            except Exception as e:
-                LOG.error("Error while drop resource: %s: %s" %
-                          (resource, e))
-                raise
+        # NOTE: The owed accounts are checked by owed_period
+        last_period = (self.begin +
+                       (self.periods - 1) * CONF.processor.cloudkitty_period)
+        return dict(user_id=rate_user_id,
+                    project_id=self.project_id,
+                    consumption=self.period_cost,
+                    begin=self.begin,
+                    period=last_period)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import json
+import os
+import time
+
+
+class Stats(object):
+    """Timers and counters of the processor.
+
+    The timers (seconds spent and number of calls per kind of work, like
+    gnocchi, keystone, rpc or lock) and the counters are kept for the
+    current period and the previous one. The lag behind the cloudkitty
+    top watermark and the errors are kept per project.
+    """
+
+    def __init__(self):
+        self.current = self._new_period()
+        self.last = None
+        self.projects = collections.defaultdict(dict)
+
+    @staticmethod
+    def _new_period():
+        return {'started_at': time.time(),
+                'timers': collections.defaultdict(float),
+                'calls': collections.Counter(),
+                'counts': collections.Counter()}
+
+    def new_period(self):
+        self.current['elapsed'] = time.time() - self.current['started_at']
+        self.last = self.current
+        self.current = self._new_period()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.current['timers'][name] += time.time() - started_at
+            self.current['calls'][name] += 1
+
+    def count(self, name, value=1):
+        self.current['counts'][name] += value
+
+    def set_lag(self, project_id, lag):
+        self.projects[project_id]['lag'] = lag
+
+    def error(self, project_id, error):
+        self.count('errors')
+        project = self.projects[project_id]
+        project['errors'] = project.get('errors', 0) + 1
+        project['last_error'] = str(error)
+
+    def report(self):
+        lags = [project['lag'] for project in self.projects.values()
+                if 'lag' in project]
+        return {'current_period': dict(self.current),
+                'last_period': dict(self.last) if self.last else None,
+                'max_lag': max(lags) if lags else 0,
+                'lagging_projects': len([lag for lag in lags if lag]),
+                'projects': dict(self.projects)}
+
+    def dump(self, path):
+        """Write the report as JSON, atomically replacing the file."""
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'w') as stats_file:
+            json.dump(self.report(), stats_file, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 Openstack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import time
+
+from eventlet import semaphore
+from oslo_config import cfg
+from oslo_log import log
+
+from shadowfiend.common import context
+from shadowfiend.processor.service import fetcher
+from shadowfiend.services import cinder
+from shadowfiend.services import glance
+from shadowfiend.services import neutron
+from shadowfiend.services import nova
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+cfg.CONF.import_group('processor', 'shadowfiend.processor.config')
+
+service_map = {'compute': nova,
+               'image': glance,
+               'volume.volume': cinder,
+               'volume.snapshot': cinder,
+               'ratelimit.gw': neutron,
+               'ratelimit.fip': neutron,
+               'loadbalancer': neutron}
+
+client_map = {nova: nova.NovaClient,
+              glance: glance.GlanceClient,
+              cinder: cinder.CinderClient,
+              neutron: neutron.NeutronClient}
+
+
+def _resource_service(services, resource):
+    """Return the service of a gnocchi resource, None if not monitored."""
+    for service in services:
+        if service not in fetcher.metric_mappings:
+            return service
+        if fetcher.metric_mappings[service] in resource.get('metrics', {}):
+            return service
+    return None
+
+
+PENDING = 'pending'
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TeardownEngine(object):
+    """Drop the resources of the owed projects in the background.
+
+    One client is kept per service, and the resources of a service are
+    dropped concurrently, at most teardown_concurrency at a time.
+
+    Every deletion is recorded in the teardown action ledger, so the
+    following runs for the same project only look for the resources
+    started since the previous scan, and only drop the new resources and
+    the ones which failed or were interrupted.
+    """
+
+    def __init__(self, gnocchi_fetcher, conductor):
+        self.gnocchi_fetcher = gnocchi_fetcher
+        self.conductor = conductor
+        self.context = context.make_admin_context(all_tenants=True)
+        self._clients = {}
+        self._semaphores = {}
+        self._projects = set()
+        self._scanned_at = {}
+
+    def _client(self, module):
+        if module not in self._clients:
+            self._clients[module] = client_map[module]()
+        return self._clients[module]
+
+    def _semaphore(self, module):
+        if module not in self._semaphores:
+            self._semaphores[module] = semaphore.Semaphore(
+                CONF.processor.teardown_concurrency)
+        return self._semaphores[module]
+
+    def submit(self, project_id):
+        """Start dropping the resources of a project, unless it is already.
+
+        :returns: the green thread doing it, or None
+        """
+        if project_id in self._projects:
+            return None
+        self._projects.add(project_id)
+        return eventlet.spawn(self._teardown, project_id)
+
+    def _scan(self, project_id, ledger):
+        """Return the (service, resource_id) not in the ledger yet.
+
+        Each resource type is searched once, the services sharing it being
+        told apart by their metric, like in get_bills.
+
+        :returns: the resources and the time to search from next time, None
+                  if a search failed
+        """
+        started_after = self._scanned_at.get(project_id)
+        scanned_at = time.time()
+        resource_types = {}
+        for service in CONF.processor.services:
+            resource_types.setdefault(fetcher.resource_mappings[service],
+                                      []).append(service)
+        resources = []
+        complete = True
+        for resource_type, services in resource_types.items():
+            found = self.gnocchi_fetcher.get_resources(
+                project_id, resource_type, started_after=started_after)
+            if found is None:
+                LOG.warning("Fail to search the %s resources of project %s" %
+                            (resource_type, project_id))
+                complete = False
+                continue
+            for resource in found:
+                service = _resource_service(services, resource)
+                if service and (service, resource['id']) not in ledger:
+                    resources.append((service, resource['id']))
+        if not complete:
+            return resources, None
+        # NOTE: Resources may be indexed by gnocchi some time after they
+        # started, look a period back.
+        return resources, scanned_at - CONF.processor.cloudkitty_period
+
+    def _record(self, project_id, resources, status):
+        if not resources:
+            return
+        self.conductor.set_teardown_actions(
+            self.context, project_id,
+            [dict(service=service, resource_id=resource_id, status=status)
+             for service, resource_id in resources])
+
+    def _teardown(self, project_id):
+        try:
+            ledger = dict(
+                ((action['service'], action['resource_id']), action)
+                for action in
+                self.conductor.get_teardown_actions(self.context,
+                                                    project_id))
+            resources, scanned_at = self._scan(project_id, ledger)
+            self._record(project_id, resources, PENDING)
+            # NOTE: The next scans only skip the resources started before
+            # once they are all in the ledger.
+            if scanned_at is not None:
+                self._scanned_at[project_id] = scanned_at
+
+            stale = time.time() - CONF.processor.teardown_action_timeout
+            for action in ledger.values():
+                if (action['status'] == FAILED or
+                        (action['status'] in (PENDING, IN_FLIGHT) and
+                         action['updated_at'] < stale)):
+                    resources.append((action['service'],
+                                      action['resource_id']))
+            if not resources:
+                return 0
+
+            self._record(project_id, resources, IN_FLIGHT)
+            threads = [eventlet.spawn(self._drop, service, resource_id)
+                       for service, resource_id in resources]
+            results = [thread.wait() for thread in threads]
+            self._record(project_id,
+                         [r for r, ok in zip(resources, results) if ok],
+                         DONE)
+            self._record(project_id,
+                         [r for r, ok in zip(resources, results) if not ok],
+                         FAILED)
+            return sum(results)
+        except Exception:
+            LOG.exception("Error while dropping the resources of project "
+                          "%s" % project_id)
+        finally:
+            self._projects.discard(project_id)
+
+    def _drop(self, service, resource_id):
+        module = service_map[service]
+        with self._semaphore(module):
+            try:
+                module.drop_resource(service, resource_id,
+                                     client=self._client(module))
+            except Exception as e:
+                LOG.error("Error while drop resource: %s: %s" %
+                          (resource_id, e))
+                return 0
+        return 1
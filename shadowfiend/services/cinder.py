@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import time
 
 from oslo_config import cfg
@@ -26,9 +27,12 @@ from shadowfiend.common.exception import NotFound
 LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
+DETACH_TIMEOUT = 60
+DETACH_POLL_INTERVAL = 2
 
-def drop_resource(service, resource_id):
-    _volume_client = CinderClient()
+
+def drop_resource(service, resource_id, client=None):
+    _volume_client = client or CinderClient()
     if service == 'volume.volume':
         _volume_client.delete_volume(resource_id)
     elif service == 'volume.snapshot':
@@ -73,6 +77,8 @@ class CinderClient(object):
             except Exception:
                 pass
         volume = self.get_volume(volume_id, region_name=region_name)
+        if volume is None:
+            return
         for attachment in volume['attachments']:
             try:
                 self.cinder_client.volumes.detach(volume_id,
@@ -80,9 +86,23 @@ class CinderClient(object):
             except Exception:
                 pass
 
-        # wait 10 seconds to delete this volume
-        time.sleep(10)
+        self.wait_detached(volume_id, region_name=region_name)
         self.cinder_client.volumes.delete(volume_id)
 
+    def wait_detached(self, volume_id, region_name=None,
+                      timeout=DETACH_TIMEOUT, interval=DETACH_POLL_INTERVAL):
+        """Poll the volume until it is detached, yielding in between."""
+        deadline = time.time() + timeout
+        while True:
+            volume = self.get_volume(volume_id, region_name=region_name)
+            if (volume is None or volume['original_status'] not in
+                    ('in-use', 'attaching', 'detaching')):
+                return
+            if time.time() >= deadline:
+                LOG.warning("Volume %s is still %s after %d seconds" %
+                            (volume_id, volume['original_status'], timeout))
+                return
+            eventlet.sleep(interval)
+
     def delete_snapshot(self, snap_id, region_name=None):
         self.cinder_client.volume_snapshots.delete(snap_id)
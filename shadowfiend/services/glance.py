@@ -23,8 +23,8 @@ LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
 
-def drop_resource(service, resource_id):
-    _glance_client = GlanceClient()
+def drop_resource(service, resource_id, client=None):
+    _glance_client = client or GlanceClient()
     if service == 'image':
         _glance_client.delete_image(resource_id)
 
@@ -23,8 +23,8 @@ LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
 
-def drop_resource(service, resource_id):
-    _neutron_client = NeutronClient()
+def drop_resource(service, resource_id, client=None):
+    _neutron_client = client or NeutronClient()
     if service == 'ratelimit.fip':
         _neutron_client.delete_fip(resource_id)
     elif service == 'loadbalancer':
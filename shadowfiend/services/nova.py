@@ -24,8 +24,8 @@ LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
 
-def drop_resource(service, resource_id):
-    _nova_client = NovaClient()
+def drop_resource(service, resource_id, client=None):
+    _nova_client = client or NovaClient()
     if service == 'compute':
         _nova_client.delete_server(resource_id)
 
@@ -43,6 +43,13 @@ class TestGetAccount(api_base.FunctionalTest):
             conductor_api, 'get_accounts', conductor_utils.get_test_accounts):
             response = self.get_json('/accounts?limit=2')
             self.assertEqual(2, len(response['accounts']))
+            response = self.get_json('/accounts?limit=2&marker=%s' %
+                                     response['next_marker'])
+            self.assertEqual(1, len(response['accounts']))
+            self.assertIsNone(response['next_marker'])
+            response = self.get_json('/accounts?marker=unknown',
+                                     expect_errors=True)
+            self.assertEqual(404, response.status_int)
 
     def test_get_one_charge(self):
         num = 0
@@ -54,14 +61,12 @@ class TestGetAccount(api_base.FunctionalTest):
             charge_list.append(charge)
             num += 1
 
-        with mock.patch.object(
-            conductor_api, 'get_charges', conductor_utils.get_test_charges):
-            with mock.patch.object(
-                conductor_api, 'get_charges_price_and_count',
-                conductor_utils.get_test_charges_price_and_count):
-                    response = self.get_json('/accounts/%s/charges' %
-                                             account['user_id'])
-                    self.assertEqual(3, len(response['charges']))
+        with mock.patch.object(conductor_api, 'get_charges_with_totals',
+                               conductor_utils.get_test_charges_with_totals):
+            response = self.get_json('/accounts/%s/charges?limit=2' %
+                                     account['user_id'])
+            self.assertEqual(2, len(response['charges']))
+            self.assertEqual(3, response['total_count'])
 
     def test_get_all_charge(self):
         num_1, num_2 = 0, 0
@@ -78,17 +83,13 @@ class TestGetAccount(api_base.FunctionalTest):
         def mock_ks_client(*args):
             return {}
 
-        with mock.patch.object(
-            conductor_api, 'get_charges', conductor_utils.get_test_charges):
-            with mock.patch.object(conductor_api,
-                                   'get_charges_price_and_count',
-                                   (conductor_utils.
-                                    get_test_charges_price_and_count)):
-                with mock.patch.object(ks_client, 'get_user',
-                                       mock_ks_client):
-                    response = self.get_json('/accounts/charges')
-                    self.assertEqual(response['total_count'],
-                                     len(response['charges']))
+        with mock.patch.object(conductor_api, 'get_charges_with_totals',
+                               conductor_utils.get_test_charges_with_totals):
+            with mock.patch.object(ks_client, 'get_user',
+                                   mock_ks_client):
+                response = self.get_json('/accounts/charges')
+                self.assertEqual(response['total_count'],
+                                 len(response['charges']))
 
 
 class TestPostAccount(api_base.FunctionalTest):
@@ -86,3 +86,20 @@ class RPCAPITestCase(base.DbTestCase):
                           consumption=10,
                           user_id=self.fake_account['user_id'],
                           project_id=self.fake_project['project_id'])
+
+    def test_get_states(self):
+        self._test_rpcapi('get_states',
+                          '_call',
+                          version='1.0',
+                          context=self.context,
+                          project_ids=[self.fake_project['project_id']])
+
+    def test_set_teardown_actions(self):
+        self._test_rpcapi('set_teardown_actions',
+                          '_call',
+                          version='1.0',
+                          context=self.context,
+                          project_id=self.fake_project['project_id'],
+                          actions=[{'resource_id': 'fake-resource',
+                                    'service': 'compute',
+                                    'status': 'pending'}])
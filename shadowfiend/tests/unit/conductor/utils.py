@@ -77,6 +77,10 @@ def get_test_charges_price_and_count(context, *args, **kwargs):
     return dbapi.get_charges_price_and_count(context, **kwargs)
 
 
+def get_test_charges_with_totals(context, *args, **kwargs):
+    return dbapi.get_charges_with_totals(context, **kwargs)
+
+
 def charge_test_account(_bond, context, *args, **kwargs):
     return dbapi.charge_account(context, *args, **kwargs)
 
@@ -15,6 +15,10 @@
 
 """Tests for manipulating Accounts via the DB API"""
 
+import datetime
+
+from oslo_utils import timeutils
+from shadowfiend.tests.unit.conductor import utils as conductor_utils
 from shadowfiend.tests.unit.db import base
 from shadowfiend.tests.unit.db import utils
 
@@ -23,3 +27,182 @@ class DbAccountTestCase(base.DbTestCase):
 
     def test_create_account(self):
         utils.create_test_account(self.context)
+
+    def test_update_account_owed(self):
+        account = conductor_utils.create_test_account(self.context)
+        project = conductor_utils.create_test_project(
+            self.context, user_id=account.user_id)
+        conductor_utils.create_test_relation(
+            self.context, user_id=account.user_id,
+            project_id=project.project_id)
+
+        self.dbapi.update_account(self.context, account.user_id,
+                                  project.project_id, 6)
+        self.assertFalse(self.dbapi.get_account(
+            self.context, account.user_id)['owed'])
+        self.dbapi.update_account(self.context, account.user_id,
+                                  project.project_id, 6)
+        owed = self.dbapi.get_account(self.context, account.user_id)
+        self.assertTrue(owed['owed'])
+        self.assertEqual(-2, owed['balance'])
+        self.assertEqual(12, owed['consumption'])
+
+        # Already owed, the account stays owed since the same time
+        self.dbapi.update_account(self.context, account.user_id,
+                                  project.project_id, 1)
+        account = self.dbapi.get_account(self.context, account.user_id)
+        self.assertEqual(owed['owed_at'], account['owed_at'])
+        self.assertEqual(13, account['consumption'])
+        self.assertEqual(13, self.dbapi.get_project(
+            self.context, project.project_id)['consumption'])
+
+    def test_get_expired_owed_accounts(self):
+        now = timeutils.utcnow()
+        expired = [
+            utils.create_test_account(
+                self.context, owed=True, level=2,
+                owed_at=now - datetime.timedelta(days=3)),
+            utils.create_test_account(
+                self.context, owed=True, level=0,
+                owed_at=now - datetime.timedelta(minutes=1))]
+        for kwargs in ({'owed': True, 'level': 4, 'days': 3},
+                       {'owed': True, 'level': 9, 'days': 30},
+                       {'owed': False, 'level': 0, 'days': 3}):
+            utils.create_test_account(
+                self.context, owed=kwargs['owed'], level=kwargs['level'],
+                owed_at=now - datetime.timedelta(days=kwargs['days']))
+
+        accounts = self.dbapi.get_expired_owed_accounts(self.context)
+        self.assertEqual(sorted(account['user_id'] for account in expired),
+                         sorted(account['user_id'] for account in accounts))
+
+    def test_bill_project(self):
+        account = conductor_utils.create_test_account(self.context)
+        project = conductor_utils.create_test_project(
+            self.context, user_id=account.user_id)
+        conductor_utils.create_test_relation(
+            self.context, user_id=account.user_id,
+            project_id=project.project_id)
+
+        self.assertTrue(self.dbapi.bill_project(
+            self.context, account.user_id, project.project_id, 1, 3600,
+            3600))
+        self.assertFalse(self.dbapi.bill_project(
+            self.context, account.user_id, project.project_id, 1, 3600,
+            3600))
+
+        outbox = self.dbapi.get_state_outbox(self.context)
+        self.assertEqual([(project.project_id, 3600)],
+                         [(row['project_id'], row['state'])
+                          for row in outbox])
+        self.assertEqual(
+            9, self.dbapi.get_account(self.context,
+                                      account.user_id)['balance'])
+        self.dbapi.delete_state_outbox(self.context,
+                                       [row['id'] for row in outbox])
+        self.assertEqual([], self.dbapi.get_state_outbox(self.context))
+
+    def test_bill_project_overlapping_window(self):
+        account = conductor_utils.create_test_account(self.context)
+        project = conductor_utils.create_test_project(
+            self.context, user_id=account.user_id)
+        conductor_utils.create_test_relation(
+            self.context, user_id=account.user_id,
+            project_id=project.project_id)
+
+        self.assertTrue(self.dbapi.bill_project(
+            self.context, account.user_id, project.project_id, 3, 3600,
+            3600 * 3))
+        # Windows overlapping the billed one, ending before or after it,
+        # or leaving a gap are all rejected
+        for begin, state in ((3600 * 2, 3600 * 4), (0, 3600 * 2),
+                             (3600 * 5, 3600 * 5)):
+            self.assertFalse(self.dbapi.bill_project(
+                self.context, account.user_id, project.project_id, 3,
+                begin, state))
+        self.assertEqual(
+            7, self.dbapi.get_account(self.context,
+                                      account.user_id)['balance'])
+        self.assertEqual({project.project_id: 3600 * 3},
+                         self.dbapi.get_states(self.context,
+                                               [project.project_id]))
+
+        self.assertTrue(self.dbapi.bill_project(
+            self.context, account.user_id, project.project_id, 2, 3600 * 4,
+            3600 * 5))
+        self.assertEqual(
+            5, self.dbapi.get_account(self.context,
+                                      account.user_id)['balance'])
+
+    def test_update_accounts(self):
+        account = conductor_utils.create_test_account(self.context)
+        projects = []
+        for i in range(2):
+            project = conductor_utils.create_test_project(
+                self.context, user_id=account.user_id)
+            conductor_utils.create_test_relation(
+                self.context, user_id=account.user_id,
+                project_id=project.project_id)
+            projects.append(project.project_id)
+        self.dbapi.bill_project(self.context, account.user_id, projects[1],
+                                1, 3600, 3600)
+        # Both bills end with the same period, the second project having
+        # its first one billed already
+        bills = [dict(user_id=account.user_id, project_id=project_id,
+                      consumption=2, begin=begin, period=3600 * 2)
+                 for project_id, begin in zip(projects, (3600, 7200))]
+
+        results = self.dbapi.update_accounts(self.context, bills)
+        self.assertEqual([dict(project_id=project_id, billed=True,
+                               error=None) for project_id in projects],
+                         results)
+        # Replayed, nothing is billed twice
+        results = self.dbapi.update_accounts(self.context, bills)
+        self.assertEqual([False, False],
+                         [result['billed'] for result in results])
+        # Nor a stale window overlapping the billed ones
+        results = self.dbapi.update_accounts(
+            self.context, [dict(bill, begin=3600, period=3600 * 3)
+                           for bill in bills])
+        self.assertEqual([False, False],
+                         [result['billed'] for result in results])
+        self.assertEqual(
+            5, self.dbapi.get_account(self.context,
+                                      account.user_id)['balance'])
+        self.assertEqual(dict((project_id, 7200) for project_id in projects),
+                         self.dbapi.get_states(self.context, projects))
+
+        # A faulty bill only fails itself
+        bills = [dict(user_id=account.user_id, project_id=projects[0],
+                      consumption=1, begin=3600 * 3, period=3600 * 3),
+                 dict(user_id='unknown', project_id=projects[1],
+                      consumption=1, begin=3600 * 3, period=3600 * 3)]
+        results = self.dbapi.update_accounts(self.context, bills)
+        self.assertTrue(results[0]['billed'])
+        self.assertIsNone(results[0]['error'])
+        self.assertFalse(results[1]['billed'])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertEqual(
+            4, self.dbapi.get_account(self.context,
+                                      account.user_id)['balance'])
+
+    def test_get_charges_marker(self):
+        account = conductor_utils.create_test_account(self.context)
+        for i in range(5):
+            conductor_utils.create_test_charge(self.context, account.user_id)
+        charges = self.dbapi.get_charges(self.context,
+                                         sort_key='created_at')
+
+        pages = []
+        marker = None
+        while True:
+            page = self.dbapi.get_charges(self.context, limit=2,
+                                          sort_key='created_at',
+                                          marker=marker)
+            pages.append([charge['charge_id'] for charge in page])
+            if len(page) < 2:
+                break
+            marker = page[-1]['charge_id']
+        self.assertEqual([2, 2, 1], map(len, pages))
+        self.assertEqual([charge['charge_id'] for charge in charges],
+                         sum(pages, []))
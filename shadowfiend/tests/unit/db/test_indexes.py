@@ -0,0 +1,62 @@
+# Copyright 2018 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the indexes used by the hot DB API lookups"""
+
+import datetime
+
+from shadowfiend.db.sqlalchemy import api as sqla_api
+from shadowfiend.db.sqlalchemy import models
+from shadowfiend.tests.unit.db import base
+
+
+class DbIndexTestCase(base.DbTestCase):
+
+    def _query_plan(self, query):
+        engine = sqla_api.get_engine()
+        compiled = query.statement.compile(dialect=engine.dialect)
+        params = [compiled.params[key] for key in compiled.positiontup]
+        rows = engine.execute('EXPLAIN QUERY PLAN %s' % compiled, params)
+        return ' '.join(row[-1] for row in rows)
+
+    def test_account_lookups(self):
+        session = sqla_api.get_session()
+        self.assertIn('ix_account_user_id', self._query_plan(
+            session.query(models.Account).filter_by(user_id='user')))
+        self.assertIn('ix_account_deleted_owed_updated_at', self._query_plan(
+            session.query(models.Account).
+            filter_by(deleted=False, owed=True).
+            filter(models.Account.updated_at > datetime.datetime(2018, 1,
+                                                                 1))))
+
+    def test_project_lookups(self):
+        session = sqla_api.get_session()
+        self.assertIn('ix_project_project_id', self._query_plan(
+            session.query(models.Project).filter_by(project_id='project')))
+        self.assertIn('ix_project_user_id', self._query_plan(
+            session.query(models.Project).filter_by(user_id='user')))
+
+    def test_charge_lookups(self):
+        session = sqla_api.get_session()
+        start = datetime.datetime(2018, 1, 1)
+        end = datetime.datetime(2018, 2, 1)
+        self.assertIn('ix_charge_user_id_charge_time', self._query_plan(
+            session.query(models.Charge).filter_by(user_id='user').
+            filter(models.Charge.charge_time >= start,
+                   models.Charge.charge_time < end)))
+        self.assertIn('ix_charge_charge_time', self._query_plan(
+            session.query(models.Charge).
+            filter(models.Charge.charge_time >= start,
+                   models.Charge.charge_time < end)))
@@ -0,0 +1,95 @@
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import mock
+
+from oslo_config import cfg
+from shadowfiend.processor.service import backfill
+from shadowfiend.processor.service import fetcher
+from shadowfiend.tests.unit.conductor import utils as conductor_utils
+from shadowfiend.tests.unit.db import base
+
+CONF = cfg.CONF
+
+cfg.CONF.import_group('processor', 'shadowfiend.processor.config')
+
+
+class TestBackfill(base.DbTestCase):
+    def setUp(self):
+        super(TestBackfill, self).setUp()
+        with mock.patch.object(fetcher, 'GnocchiFetcher'):
+            self.backfill = backfill.Backfill(self.dbapi, window=4)
+        self.backfill.coord = mock.Mock()
+        self.account = conductor_utils.create_test_account(self.context)
+        self.project = conductor_utils.create_test_project(
+            self.context, user_id=self.account.user_id)
+
+    def test_run(self):
+        period = CONF.processor.cloudkitty_period
+        states = {'shadowfiend': None, 'cloudkitty': 10 * period}
+        gnocchi_fetcher = self.backfill.gnocchi_fetcher
+        gnocchi_fetcher.get_state.side_effect = (
+            lambda project_id, state_type, order_type:
+                period if order_type == 'bottom' else states[state_type])
+        gnocchi_fetcher.get_period_consumes.side_effect = (
+            lambda project_id, begin, periods: [0.5] * periods)
+
+        project_id = self.project.project_id
+        self.assertEqual({project_id: 8},
+                         self.backfill.run([project_id]))
+        # From the period after the bottom one to the top one, 4 at a time
+        gnocchi_fetcher.get_period_consumes.assert_has_calls([
+            mock.call(project_id, 2 * period, 4),
+            mock.call(project_id, 6 * period, 4)])
+        self.assertEqual({project_id: 9 * period},
+                         self.dbapi.get_states(self.context))
+        self.assertEqual([9 * period],
+                         [row['state'] for row in
+                          self.dbapi.get_state_outbox(self.context)])
+        self.assertEqual(
+            6, self.dbapi.get_account(self.context,
+                                      self.account.user_id)['balance'])
+
+        # Nothing left to bill
+        self.assertEqual({project_id: 0},
+                         self.backfill.run([project_id]))
+
+    def test_run_reads_state_once_locked(self):
+        period = CONF.processor.cloudkitty_period
+        project_id = self.project.project_id
+        gnocchi_fetcher = self.backfill.gnocchi_fetcher
+        states = {'shadowfiend': None, 'cloudkitty': 5 * period}
+        gnocchi_fetcher.get_state.side_effect = (
+            lambda project_id, state_type, order_type:
+                period if order_type == 'bottom' else states[state_type])
+        gnocchi_fetcher.get_period_consumes.side_effect = (
+            lambda project_id, begin, periods: [1] * periods)
+        lock = self.backfill.coord.get_lock.return_value
+
+        def acquire(blocking):
+            # A processor bills the project while the backfill waits
+            conductor_utils.create_test_relation(
+                self.context, user_id=self.account.user_id,
+                project_id=project_id)
+            self.dbapi.bill_project(self.context, self.account.user_id,
+                                    project_id, 1, 3 * period, 3 * period)
+            return True
+        lock.acquire.side_effect = acquire
+
+        # Only the period following the billed state is backfilled
+        self.assertEqual({project_id: 1},
+                         self.backfill.run([project_id]))
+        gnocchi_fetcher.get_period_consumes.assert_called_once_with(
+            project_id, 4 * period, 1)
+        self.assertEqual(
+            8, self.dbapi.get_account(self.context,
+                                      self.account.user_id)['balance'])
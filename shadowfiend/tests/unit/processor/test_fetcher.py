@@ -0,0 +1,187 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import mock
+import time
+
+from gnocchiclient import exceptions as gexceptions
+from oslo_config import cfg
+from shadowfiend.common import timeutils
+from shadowfiend.processor.handlers import billing_owner
+from shadowfiend.processor.service import fetcher
+from shadowfiend.tests.unit.db import base
+
+CONF = cfg.CONF
+
+
+def mock_keystone_init(self):
+    self._rating_ids = None
+    self._rate_projects = None
+    self._rate_projects_at = 0
+    self.ks_client = mock.Mock()
+
+
+def mock_client_init(self):
+    self._period = CONF.processor.cloudkitty_period
+    self._granularity = None
+    self.gnocchi_client = mock.Mock()
+
+
+class TestGnocchiFetcher(base.DbTestCase):
+    def setUp(self):
+        super(TestGnocchiFetcher, self).setUp()
+
+        with mock.patch.object(
+                fetcher.GnocchiFetcher, '__init__', mock_client_init):
+            self.fetcher = fetcher.GnocchiFetcher()
+        self.client = self.fetcher.gnocchi_client
+        self.addCleanup(fetcher._STATE_METRICS.clear)
+
+    def test_get_projects_consume(self):
+        self.client.metric.aggregation.return_value = [
+            {'group': {'project_id': 'project-1'},
+             'measures': [('2018-01-01T00:00:00', 3600, 1.5),
+                          ('2018-01-01T01:00:00', 3600, 2.0)]},
+            {'group': {'project_id': 'project-2'},
+             'measures': [('2018-01-01T00:00:00', 3600, 0.5)]}]
+        consumes = self.fetcher.get_projects_consume(
+            ['project-1', 'project-2', 'project-3'], 3600, periods=2)
+        self.assertEqual({'project-1': 3.5,
+                          'project-2': 0.5,
+                          'project-3': 0}, consumes)
+        kwargs = self.client.metric.aggregation.call_args[1]
+        self.assertEqual(['project_id'], kwargs['groupby'])
+        self.assertEqual({'in': {'project_id': ['project-1', 'project-2',
+                                                'project-3']}},
+                         kwargs['query'])
+        self.assertEqual(3600 + 2 * CONF.processor.cloudkitty_period,
+                         kwargs['stop'])
+
+    def test_set_state_cached_metric(self):
+        self.client.resource.search.return_value = [
+            {'id': 'resource-1', 'project_id': 'project-1',
+             'metrics': {fetcher.SHADOWFIEND_STATE_METRIC: 'metric-1'}}]
+        self.fetcher.warm_state_cache()
+        self.client.resource.search.reset_mock()
+
+        self.fetcher.set_state('project-1', 3600)
+        self.assertFalse(self.client.resource.search.called)
+        self.assertEqual('metric-1',
+                         self.client.metric.add_measures.call_args[0][0])
+
+    def test_set_state_metric_gone(self):
+        fetcher._STATE_METRICS['project-1'] = ('resource-1', 'metric-1')
+        self.client.metric.add_measures.side_effect = [
+            gexceptions.MetricNotFound(404), None]
+        self.client.resource.search.return_value = [{'id': 'resource-2'}]
+        self.client.resource.get.return_value = {
+            'metrics': {fetcher.SHADOWFIEND_STATE_METRIC: 'metric-2'}}
+
+        self.fetcher.set_state('project-1', 3600)
+        self.assertEqual('metric-2',
+                         self.client.metric.add_measures.call_args[0][0])
+        self.assertEqual(('resource-2', 'metric-2'),
+                         fetcher._STATE_METRICS['project-1'])
+
+    def test_queue_state_flush(self):
+        fetcher._STATE_METRICS['project-1'] = ('resource-1', 'metric-1')
+        fetcher._STATE_METRICS['project-2'] = ('resource-2', 'metric-2')
+        self.fetcher._pending_states = {}
+        self.fetcher._flushed_at = time.time()
+        cfg.CONF.set_override('state_flush_size', 2, group='processor')
+
+        self.fetcher.queue_state('project-1', 3600)
+        self.fetcher.queue_state('project-1', 7200)
+        self.assertFalse(self.client.metric.batch_metrics_measures.called)
+        self.fetcher.queue_state('project-2', 3600)
+
+        measures = self.client.metric.batch_metrics_measures.call_args[0][0]
+        self.assertEqual(['metric-1', 'metric-2'], sorted(measures))
+        self.assertEqual(timeutils.ts2dt(7200).isoformat(),
+                         measures['metric-1'][0]['timestamp'])
+        self.assertEqual({}, self.fetcher._pending_states)
+        self.assertFalse(self.client.metric.add_measures.called)
+
+    def test_aggregate_granularity(self):
+        self.client.archive_policy.get.return_value = {
+            'definition': [{'granularity': '0:05:00'},
+                           {'granularity': '1 day, 0:00:00'}]}
+        self.client.metric.aggregation.return_value = []
+        with mock.patch.object(fetcher.LOG, 'warning') as warning:
+            self.fetcher.get_current_consume('project-1', 3600)
+            self.fetcher.get_current_consume('project-1', 7200)
+        # The coarser granularity is told once
+        self.assertEqual(1, warning.call_count)
+        self.assertEqual(1, self.client.archive_policy.get.call_count)
+        self.assertEqual(
+            [86400, 86400],
+            [call[1]['granularity'] for call in
+             self.client.metric.aggregation.call_args_list])
+
+        # The policy changed
+        self.client.archive_policy.get.return_value = {
+            'definition': [{'granularity': 3600.0}]}
+        self.client.metric.aggregation.side_effect = [
+            gexceptions.BadRequest(400), []]
+        self.fetcher.get_current_consume('project-1', 10800)
+        self.assertEqual(3600, self.client.metric.aggregation.call_args[1][
+            'granularity'])
+        self.assertEqual(2, self.client.archive_policy.get.call_count)
+
+
+class TestKeystoneFetcher(base.DbTestCase):
+    def setUp(self):
+        super(TestKeystoneFetcher, self).setUp()
+
+        with mock.patch.object(
+                fetcher.KeystoneFetcher, '__init__', mock_keystone_init):
+            self.fetcher = fetcher.KeystoneFetcher()
+        self.client = self.fetcher.ks_client
+        self.client.users.list.return_value = [mock.Mock(id='user-1')]
+        self.client.roles.list.return_value = [mock.Mock(id='role-1')]
+        self.client.role_assignments.list.return_value = [
+            mock.Mock(scope={'project': {'id': 'project-2'}}),
+            mock.Mock(scope={'project': {'id': 'project-1'}}),
+            mock.Mock(scope={'domain': {'id': 'default'}})]
+
+    def test_get_rate_projects(self):
+        self.assertEqual(['project-1', 'project-2'],
+                         self.fetcher.get_rate_projects())
+        self.client.role_assignments.list.assert_called_once_with(
+            user='user-1', role='role-1')
+
+        # Served from the cache until rate_projects_ttl expires
+        self.assertEqual(['project-1', 'project-2'],
+                         self.fetcher.get_rate_projects())
+        self.assertEqual(1, self.client.role_assignments.list.call_count)
+        self.assertEqual(1, self.client.users.list.call_count)
+
+        self.fetcher._rate_projects_at -= CONF.processor.rate_projects_ttl
+        self.fetcher.get_rate_projects()
+        self.assertEqual(2, self.client.role_assignments.list.call_count)
+        self.assertEqual(1, self.client.users.list.call_count)
+
+    def test_get_billing_owner(self):
+        self.addCleanup(fetcher._BILLING_OWNERS.clear)
+        fetcher.set_billing_owners({'project-1': 'user-1'})
+        with mock.patch.object(self.fetcher, 'get_rate_user',
+                               return_value='user-2') as get_rate_user:
+            self.assertEqual('user-1',
+                             self.fetcher.get_billing_owner('project-1'))
+            self.assertFalse(get_rate_user.called)
+
+            billing_owner.Handler().billing_owner_changed(
+                None, 'project-1', None)
+            self.assertEqual('user-2',
+                             self.fetcher.get_billing_owner('project-1'))
+            get_rate_user.assert_called_once_with('project-1')
+            self.assertEqual('user-2', fetcher._BILLING_OWNERS['project-1'])
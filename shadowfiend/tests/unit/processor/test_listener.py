@@ -0,0 +1,105 @@
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import eventlet
+import mock
+import oslo_messaging as messaging
+
+from oslo_config import cfg
+from shadowfiend.processor.service import listener
+from shadowfiend.tests import base
+
+CONF = cfg.CONF
+
+
+class TestRatingListener(base.BaseTestCase):
+    def setUp(self):
+        super(TestRatingListener, self).setUp()
+        self.transport = messaging.get_notification_transport(
+            CONF, url='fake://')
+        self.addCleanup(self.transport.cleanup)
+        self.callback = mock.Mock()
+        self.listener = listener.get_listener(self.callback,
+                                              transport=self.transport)
+        self.listener.start()
+        self.addCleanup(self.listener.wait)
+        self.addCleanup(self.listener.stop)
+        self.notifier = messaging.Notifier(
+            self.transport, publisher_id='cloudkitty', driver='messaging')
+
+    def _wait_for(self, count):
+        for i in range(100):
+            if self.callback.call_count >= count:
+                return
+            eventlet.sleep(0.01)
+
+    def test_rating_notification(self):
+        self.notifier.info({}, 'rating.processed',
+                           {'project_id': 'project-1'})
+        self.notifier.info({}, 'compute.instance.create.end',
+                           {'tenant_id': 'project-2'})
+        self.notifier.info({}, 'rating.state.advanced',
+                           {'tenant_id': 'project-3'})
+        self._wait_for(2)
+        eventlet.sleep(0.05)
+        self.assertEqual([mock.call('project-1'), mock.call('project-3')],
+                         self.callback.call_args_list)
+
+
+class TestGetListener(base.BaseTestCase):
+    def test_pool(self):
+        with mock.patch.object(messaging,
+                               'get_notification_listener') as get_listener:
+            listener.get_listener(mock.Mock(), transport=mock.Mock())
+            self.assertEqual(CONF.processor.notification_pool,
+                             get_listener.call_args[1]['pool'])
+
+            # Every partitioned processor has its own pool
+            CONF.set_override('partitioned', True, group='processor')
+            pools = []
+            for member_id in ('processor-1', 'processor-2'):
+                listener.get_listener(mock.Mock(), transport=mock.Mock(),
+                                      member_id=member_id)
+                pools.append(get_listener.call_args[1]['pool'])
+        self.assertEqual(['%s-processor-1' % CONF.processor.notification_pool,
+                          '%s-processor-2' % CONF.processor.notification_pool],
+                         pools)
+
+    def test_partitioned(self):
+        CONF.set_override('partitioned', True, group='processor')
+        # NOTE: The fake transport queues are shared by the process
+        CONF.set_override('notification_topics', ['partitioned'],
+                          group='processor')
+        transport = messaging.get_notification_transport(CONF,
+                                                         url='fake://')
+        self.addCleanup(transport.cleanup)
+        callbacks = []
+        for member_id in ('processor-1', 'processor-2'):
+            callback = mock.Mock()
+            rating_listener = listener.get_listener(
+                callback, transport=transport, member_id=member_id)
+            rating_listener.start()
+            self.addCleanup(rating_listener.wait)
+            self.addCleanup(rating_listener.stop)
+            callbacks.append(callback)
+
+        notifier = messaging.Notifier(transport, publisher_id='cloudkitty',
+                                      driver='messaging',
+                                      topics=['partitioned'])
+        notifier.info({}, 'rating.processed', {'project_id': 'project-1'})
+        for i in range(100):
+            if all(callback.called for callback in callbacks):
+                break
+            eventlet.sleep(0.01)
+        # Both processors get the notification
+        for callback in callbacks:
+            callback.assert_called_once_with('project-1')
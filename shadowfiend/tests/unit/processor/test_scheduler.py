@@ -0,0 +1,55 @@
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from shadowfiend.processor.service import scheduler
+from shadowfiend.tests import base
+
+
+class TestScheduler(base.TestCase):
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.scheduler = scheduler.Scheduler()
+
+    def test_pop_due_most_lagging_first(self):
+        self.scheduler.schedule('project-1', 300)
+        self.scheduler.schedule('project-2', 100)
+        self.scheduler.schedule('project-3', 200)
+        self.scheduler.schedule('project-4', 1000)
+        self.assertEqual(['project-2', 'project-3', 'project-1'],
+                         self.scheduler.pop_due(500))
+        self.assertEqual(1000, self.scheduler.next_due())
+        self.assertEqual([], self.scheduler.pop_due(500))
+
+    def test_reschedule_and_sync(self):
+        self.scheduler.schedule('project-1', 100)
+        self.scheduler.schedule('project-2', 100)
+        self.scheduler.schedule('project-1', 1000)
+        self.scheduler.sync(['project-1', 'project-3'], 200)
+        self.assertNotIn('project-2', self.scheduler)
+        self.assertEqual(['project-3'], self.scheduler.pop_due(500))
+        self.assertEqual(['project-1'], self.scheduler.pop_due(1000))
+        self.assertEqual(0, len(self.scheduler))
+
+    def test_fail_backoff_and_dead_letter(self):
+        self.scheduler = scheduler.Scheduler(retry_delay=10,
+                                             max_retry_delay=25,
+                                             max_attempts=4)
+        for attempt, delay in enumerate([10, 20, 25]):
+            self.scheduler.fail('project-1', ValueError('boom'), 100)
+            self.assertEqual(100 + delay, self.scheduler.next_due())
+            self.assertEqual({'project-1': attempt + 1},
+                             self.scheduler.retrying())
+        self.scheduler.fail('project-1', ValueError('boom'), 100)
+        self.assertEqual(['project-1'], list(self.scheduler.dead_letters))
+        self.assertEqual({}, self.scheduler.retrying())
+        self.scheduler.sync(['project-1'], 200)
+        self.assertEqual([], self.scheduler.pop_due(1000))
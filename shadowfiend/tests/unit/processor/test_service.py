@@ -11,8 +11,10 @@
 #    limitations under the License.
 
 import mock
+import time
 
 from oslo_config import cfg
+from shadowfiend.common import timeutils
 from shadowfiend.common import context
 from shadowfiend.conductor import api as conductor_api
 from shadowfiend.processor.service import service
@@ -40,7 +42,7 @@ class TestWorker(base.DbTestCase):
 
         class mock_keystone_fetcher(object):
             @classmethod
-            def get_rate_user(*args):
+            def get_billing_owner(*args):
                 return account.user_id
 
         class mock_gnocchi_fetcher(object):
@@ -48,23 +50,11 @@ class TestWorker(base.DbTestCase):
             def get_resources(*args):
                 return []
 
-            @classmethod
-            def get_current_consume(*args):
-                return 0
-
-            @classmethod
-            def set_state(*args):
-                pass
-
         class mock_conductor_api(object):
             @classmethod
             def get_account(*args):
                 return conductor_utils.get_test_account(*args)
 
-            @classmethod
-            def update_account(*args, **kwargs):
-                return conductor_utils.update_test_account(*args, **kwargs)
-
         tools = {'conductor': mock_conductor_api,
                  'gnocchi_fetcher': mock_gnocchi_fetcher,
                  'keystone_fetcher': mock_keystone_fetcher}
@@ -76,14 +66,21 @@ class TestWorker(base.DbTestCase):
                 with mock.patch.object(
                     conductor_api, 'API', mock_conductor_api):
                     self.Worker = service.Worker(ctx, project.project_id,
-                                                 0, tools)
+                                                 7200, tools, 3, 3.5)
+        self.account = account
 
-    def test_owed_action(self):
-        project_id = '0eed996268e34f96a30a4a0926822257'
-        self.Worker.owed_action(project_id)
+    def test_get_bill(self):
+        self.assertEqual(
+            dict(user_id=self.account.user_id,
+                 project_id=self.Worker.project_id, consumption=3.5,
+                 begin=7200,
+                 period=7200 + 2 * CONF.processor.cloudkitty_period),
+            self.Worker.get_bill())
 
-    def test_run(self):
-        self.Worker.run()
+    def test_get_bill_no_owner(self):
+        self.Worker.keystone_fetcher = mock.Mock()
+        self.Worker.keystone_fetcher.get_billing_owner.return_value = []
+        self.assertRaises(ValueError, self.Worker.get_bill)
 
 
 class TestProcessorPeriodTasks(base.DbTestCase):
@@ -94,6 +91,10 @@ class TestProcessorPeriodTasks(base.DbTestCase):
             pass
 
         class mock_gnocchi_fetcher(object):
+            def get_cloudkitty_state(self, project_id, order_type,
+                                     after=None):
+                return self.get_state(project_id, 'cloudkitty', order_type)
+
             def get_state(self, *args):
                 if 'top' and 'shadowfiend' in args:
                     pass
@@ -108,16 +109,41 @@ class TestProcessorPeriodTasks(base.DbTestCase):
                 fetcher, 'GnocchiFetcher', mock_gnocchi_fetcher):
                 self.Pro_Per = service.ProcessorPeriodTasks(CONF)
 
-    def test_check_state_none_history(self):
+    def test_check_window_none_history(self):
         project_id = '0eed996268e34f96a30a4a0926822257'
-        next_timestamp = self.Pro_Per._check_state(project_id)
+        next_timestamp, periods = self.Pro_Per._check_window(project_id)
         self.assertNotEqual(next_timestamp, 0)
+        self.assertEqual(1, periods)
 
-    def test_check_state_history(self):
+    def test_check_window_local_state(self):
+        project_id = '0eed996268e34f96a30a4a0926822257'
+        period = CONF.processor.cloudkitty_period
+        self.Pro_Per.gnocchi_fetcher.get_state = mock.Mock(
+            return_value=period * 3)
+        self.assertEqual((period * 2, 1),
+                         self.Pro_Per._check_window(project_id, period))
+        self.Pro_Per.gnocchi_fetcher.get_state.assert_called_once_with(
+            project_id, 'cloudkitty', 'top')
+
+    def test_check_window_history(self):
         project_id = '0eed996268e34f96a30a4a0926822257'
         cfg.CONF.set_override('historical_expenses', True, group='processor')
-        next_timestamp = self.Pro_Per._check_state(project_id)
-        self.assertEqual(next_timestamp, 0)
+        self.assertEqual((0, 0), self.Pro_Per._check_window(project_id))
+
+    def test_check_window_catch_up(self):
+        project_id = '0eed996268e34f96a30a4a0926822257'
+        period = CONF.processor.cloudkitty_period
+        states = {'shadowfiend': period, 'cloudkitty': period * 11}
+        self.Pro_Per.gnocchi_fetcher.get_state = (
+            lambda project_id, state_type, order_type: states[state_type])
+        self.assertEqual((period * 2, 1),
+                         self.Pro_Per._check_window(project_id))
+        cfg.CONF.set_override('catch_up', True, group='processor')
+        self.assertEqual((period * 2, 9),
+                         self.Pro_Per._check_window(project_id))
+        cfg.CONF.set_override('catch_up_max_periods', 4, group='processor')
+        self.assertEqual((period * 2, 4),
+                         self.Pro_Per._check_window(project_id))
 
     def test_lock(self):
         project_id = '0eed996268e34f96a30a4a0926822257'
@@ -125,3 +151,236 @@ class TestProcessorPeriodTasks(base.DbTestCase):
         catalog = (u'/var/lib/shadowfiend/locks/'
                    u'shadowfiend-%s' % project_id)
         self.assertEqual(result._name, catalog)
+        self.assertIs(result, self.Pro_Per._lock(project_id))
+
+    def test_hold_locks_not_partitioned(self):
+        cfg.CONF.set_override('hold_locks', True, group='processor')
+        lock = mock.Mock()
+        with mock.patch.object(self.Pro_Per.coord, 'get_lock',
+                               return_value=lock):
+            self.assertIs(lock, self.Pro_Per._acquire('project-1'))
+            self.Pro_Per._release('project-1', lock)
+        lock.release.assert_called_once_with()
+
+    def test_hold_locks(self):
+        cfg.CONF.set_override('hold_locks', True, group='processor')
+        cfg.CONF.set_override('partitioned', True, group='processor')
+        lock = mock.Mock()
+        with mock.patch.object(self.Pro_Per.coord, 'get_lock',
+                               return_value=lock):
+            for i in range(2):
+                self.assertIs(lock, self.Pro_Per._acquire('project-1'))
+                self.Pro_Per._release('project-1', lock)
+        lock.acquire.assert_called_once_with(blocking=False)
+        self.assertFalse(lock.release.called)
+
+        self.Pro_Per._forget_locks(['project-2'])
+        lock.release.assert_called_once_with()
+        self.assertEqual({}, self.Pro_Per._locks)
+
+    def test_heartbeat(self):
+        with mock.patch.object(self.Pro_Per.coord, 'heartbeat',
+                               side_effect=Exception('down')) as heartbeat:
+            self.Pro_Per.heartbeat()
+        heartbeat.assert_called_once_with()
+
+    def test_lock_window_failed(self):
+        project_id = '0eed996268e34f96a30a4a0926822257'
+        lock = mock.Mock()
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               side_effect=Exception('down')):
+            self.assertIsNone(self.Pro_Per._lock_window(project_id, lock))
+        lock.release.assert_called_once_with()
+
+    def test_lock_window_nothing_to_bill(self):
+        project_id = '0eed996268e34f96a30a4a0926822257'
+        lock = mock.Mock()
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               return_value=(0, 0)):
+            self.assertEqual((0, 0),
+                             self.Pro_Per._lock_window(project_id, lock))
+        lock.release.assert_called_once_with()
+
+    def test_primary_period_reads_states_once_locked(self):
+        self.Pro_Per.keystone_fetcher.get_rate_projects = (
+            lambda: ['project-1', 'project-2'])
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_states.return_value = {}
+        lock = mock.Mock()
+        lock.acquire.side_effect = lambda blocking: blocking is False and (
+            lock.acquire.call_count == 1)
+        with mock.patch.object(self.Pro_Per, '_lock', return_value=lock):
+            with mock.patch.object(self.Pro_Per, '_check_window',
+                                   return_value=(0, 0)) as check_window:
+                self.Pro_Per.primary_period(None)
+        self.Pro_Per.conductor.get_states.assert_called_once_with(
+            mock.ANY, project_ids=['project-1'])
+        check_window.assert_called_once_with('project-1', None)
+        self.assertEqual(1, self.Pro_Per.stats.current['counts']['locked'])
+
+    def test_primary_period_concurrent(self):
+        projects = ['project-%d' % i for i in range(5)]
+        pending = dict((p, 2) for p in projects)
+
+        def check_window(project_id, timestamp):
+            if pending[project_id]:
+                pending[project_id] -= 1
+                return 7200 - pending[project_id] * 3600, 1
+            return 0, 0
+
+        self.Pro_Per.keystone_fetcher.get_rate_projects = (
+            lambda: list(projects))
+        self.Pro_Per.gnocchi_fetcher.get_projects_consume = mock.Mock(
+            side_effect=lambda project_ids, *args: dict(
+                (p, 1.0) for p in project_ids))
+        cfg.CONF.set_override('consume_batch_size', 2, group='processor')
+        self.Pro_Per.keystone_fetcher.get_billing_owner = (
+            lambda project_id: 'user-1')
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_states.return_value = {}
+        self.Pro_Per.conductor.get_state_outbox.return_value = []
+        self.Pro_Per.conductor.update_accounts.side_effect = (
+            lambda ctx, bills: [dict(project_id=bill['project_id'],
+                                     billed=True, error=None)
+                                for bill in bills])
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               side_effect=check_window):
+            self.Pro_Per.primary_period(None)
+        self.assertEqual(dict((p, 0) for p in projects), pending)
+        # 2 windows of 5 projects, fetched and billed 2 projects at a time
+        self.assertEqual(
+            6, self.Pro_Per.gnocchi_fetcher.get_projects_consume.call_count)
+        update_accounts = self.Pro_Per.conductor.update_accounts
+        self.assertEqual(6, update_accounts.call_count)
+        bills = [bill for call in update_accounts.call_args_list
+                 for bill in call[0][1]]
+        self.assertEqual(10, len(bills))
+        for bill in bills:
+            self.assertEqual(1.0, bill['consumption'])
+        self.Pro_Per.conductor.get_state_outbox.assert_called_once_with(
+            mock.ANY, limit=CONF.processor.state_flush_size)
+
+    def test_own_projects(self):
+        projects = ['project-1', 'project-2', 'project-3']
+        self.assertEqual(projects, self.Pro_Per._own_projects(projects))
+
+        self.Pro_Per.coord = mock.Mock()
+        self.Pro_Per.partitioner = mock.Mock()
+        self.Pro_Per.partitioner.belongs_to_self.side_effect = (
+            lambda project_id: project_id != 'project-2')
+        self.assertEqual(['project-1', 'project-3'],
+                         self.Pro_Per._own_projects(projects))
+        self.Pro_Per.coord.run_watchers.assert_called_once_with()
+
+    def test_primary_period_skips_projects_not_due(self):
+        now = timeutils.utcnow_ts()
+        state = now - now % 3600
+        self.Pro_Per.keystone_fetcher.get_rate_projects = (
+            lambda: ['project-1'])
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_states.return_value = {'project-1': state}
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               return_value=(0, 0)) as check_window:
+            self.Pro_Per.primary_period(None)
+            self.Pro_Per.primary_period(None)
+        check_window.assert_called_once_with('project-1', state)
+        self.assertEqual(state + 2 * CONF.processor.cloudkitty_period,
+                         self.Pro_Per.scheduler.next_due())
+
+    def test_primary_period_isolates_failures(self):
+        self.Pro_Per.keystone_fetcher.get_rate_projects = (
+            lambda: ['project-1', 'project-2'])
+        self.Pro_Per.gnocchi_fetcher.get_projects_consume = mock.Mock(
+            side_effect=lambda project_ids, *args: dict(
+                (p, 1.0) for p in project_ids))
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_states.return_value = {}
+        self.Pro_Per.conductor.get_state_outbox.return_value = []
+        self.Pro_Per.conductor.update_accounts.side_effect = (
+            lambda ctx, bills: [dict(project_id=bill['project_id'],
+                                     billed=True, error=None)
+                                for bill in bills])
+        # project-1 has no billing owner
+        self.Pro_Per.keystone_fetcher.get_billing_owner = (
+            lambda project_id: [] if project_id == 'project-1' else 'user-1')
+        now = timeutils.utcnow_ts()
+        begin = now - now % 3600
+
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               return_value=(begin, 1)):
+            self.Pro_Per.primary_period(None)
+        self.assertEqual({'project-1': 1}, self.Pro_Per.scheduler.retrying())
+        counts = self.Pro_Per.stats.current['counts']
+        self.assertEqual(1, counts['processed'])
+        self.assertEqual(1, counts['errors'])
+        self.assertEqual(1, self.Pro_Per.stats.projects['project-1']['errors'])
+        self.assertEqual(
+            ['project-1', 'project-2'],
+            self.Pro_Per.scheduler.pop_due(now + 2 * 3600 + 60))
+        lock = self.Pro_Per._lock('project-1')
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_primary_period_outbox_failed(self):
+        cfg.CONF.set_override('stats_file', '/tmp/stats.json',
+                              group='processor')
+        self.Pro_Per.keystone_fetcher.get_rate_projects = (
+            lambda: ['project-1'])
+        self.Pro_Per.keystone_fetcher.get_billing_owner = (
+            lambda project_id: 'user-1')
+        self.Pro_Per.gnocchi_fetcher.get_projects_consume = mock.Mock(
+            return_value={'project-1': 1.0})
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_states.return_value = {}
+        self.Pro_Per.conductor.update_accounts.return_value = [
+            dict(project_id='project-1', billed=True, error=None)]
+        self.Pro_Per.conductor.get_state_outbox.side_effect = (
+            Exception('down'))
+        now = timeutils.utcnow_ts()
+
+        with mock.patch.object(self.Pro_Per, '_check_window',
+                               return_value=(now - now % 3600, 1)):
+            with mock.patch.object(self.Pro_Per.stats, 'dump') as dump:
+                self.Pro_Per.primary_period(None)
+        # The period is reported even though the states are not mirrored
+        dump.assert_called_once_with('/tmp/stats.json')
+        self.assertEqual(1, self.Pro_Per.stats.current['counts']['processed'])
+
+    def test_owed_period(self):
+        cfg.CONF.set_override('allow_owe_action', True)
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_expired_owed_accounts.return_value = [
+            {'user_id': 'user-1', 'owed_at': '2018-01-01T00:00:00'}]
+        self.Pro_Per.conductor.get_projects.return_value = [
+            {'project_id': 'project-1'}, {'project_id': 'project-2'}]
+        self.Pro_Per.teardown = mock.Mock()
+        self.Pro_Per.owed_period(None)
+        self.Pro_Per.conductor.get_projects.assert_called_once_with(
+            mock.ANY, user_id='user-1')
+        self.assertEqual([mock.call('project-1'), mock.call('project-2')],
+                         self.Pro_Per.teardown.submit.call_args_list)
+
+    def test_notify_rated(self):
+        self.Pro_Per.keystone_fetcher.is_rate_project = (
+            lambda project_id: project_id == 'project-1')
+        self.Pro_Per.notify_rated('project-2')
+        self.assertNotIn('project-2', self.Pro_Per.scheduler)
+        self.Pro_Per.notify_rated('project-1')
+        self.assertEqual(['project-1'],
+                         self.Pro_Per.scheduler.pop_due(time.time()))
+        self.assertEqual('project-1', self.Pro_Per._notified.get_nowait())
+
+    def test_drain_outbox(self):
+        cfg.CONF.set_override('state_flush_size', 2, group='processor')
+        self.Pro_Per.conductor = mock.Mock()
+        self.Pro_Per.conductor.get_state_outbox.side_effect = [
+            [{'id': 1, 'project_id': 'project-1', 'state': 3600},
+             {'id': 2, 'project_id': 'project-2', 'state': 3600}],
+            [{'id': 3, 'project_id': 'project-1', 'state': 7200}]]
+        self.Pro_Per.gnocchi_fetcher = mock.Mock()
+        self.Pro_Per._drain_outbox(None)
+        self.assertEqual(
+            2, self.Pro_Per.gnocchi_fetcher.flush_states.call_count)
+        self.assertEqual(
+            [mock.call(None, [1, 2]), mock.call(None, [3])],
+            self.Pro_Per.conductor.delete_state_outbox.call_args_list)
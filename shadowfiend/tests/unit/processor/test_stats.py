@@ -0,0 +1,65 @@
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from shadowfiend.processor.service import stats
+from shadowfiend.tests import base
+
+
+class TestStats(base.TestCase):
+    def setUp(self):
+        super(TestStats, self).setUp()
+        self.stats = stats.Stats()
+
+    def test_timer_and_counts(self):
+        with self.stats.timer('gnocchi'):
+            pass
+        self.assertRaises(ValueError, self._raise_in_timer, 'gnocchi')
+        self.stats.count('processed')
+        self.stats.count('billed_periods', 3)
+        self.assertEqual(2, self.stats.current['calls']['gnocchi'])
+        self.assertEqual({'processed': 1, 'billed_periods': 3},
+                         self.stats.current['counts'])
+
+        self.stats.new_period()
+        self.assertEqual(2, self.stats.last['calls']['gnocchi'])
+        self.assertIn('elapsed', self.stats.last)
+        self.assertEqual({}, self.stats.current['counts'])
+
+    def _raise_in_timer(self, name):
+        with self.stats.timer(name):
+            raise ValueError()
+
+    def test_projects(self):
+        self.stats.set_lag('project-1', 7200)
+        self.stats.set_lag('project-2', 0)
+        self.stats.error('project-1', ValueError('boom'))
+        report = self.stats.report()
+        self.assertEqual(7200, report['max_lag'])
+        self.assertEqual(1, report['lagging_projects'])
+        self.assertEqual({'lag': 7200, 'errors': 1, 'last_error': 'boom'},
+                         report['projects']['project-1'])
+        self.assertEqual(1, report['current_period']['counts']['errors'])
+
+    def test_dump(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        stats_file = os.path.join(path, 'stats.json')
+        self.stats.set_lag('project-1', 3600)
+        self.stats.dump(stats_file)
+        with open(stats_file) as f:
+            self.assertEqual(3600, json.load(f)['max_lag'])
+        self.assertFalse(os.path.exists(stats_file + '.tmp'))
@@ -0,0 +1,172 @@
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import mock
+
+from oslo_config import cfg
+from shadowfiend.processor.service import teardown
+from shadowfiend.services import cinder
+from shadowfiend.services import neutron
+from shadowfiend.services import nova
+from shadowfiend.tests.unit.db import base
+
+CONF = cfg.CONF
+
+
+class mock_conductor_api(object):
+    def __init__(self, dbapi):
+        self.dbapi = dbapi
+
+    def get_teardown_actions(self, context, project_id):
+        return self.dbapi.get_teardown_actions(context, project_id)
+
+    def set_teardown_actions(self, context, project_id, actions):
+        return self.dbapi.set_teardown_actions(context, project_id, actions)
+
+
+class TestTeardownEngine(base.DbTestCase):
+    def setUp(self):
+        super(TestTeardownEngine, self).setUp()
+        cfg.CONF.set_override('services', ['compute', 'volume.volume'],
+                              group='processor')
+        self.gnocchi_fetcher = mock.Mock()
+        self.gnocchi_fetcher.get_resources.side_effect = (
+            lambda project_id, resource_type, **kwargs: [
+                {'id': '%s-%d' % (resource_type, i),
+                 'metrics': {'volume.size': 'metric'}} for i in range(3)])
+        self.engine = teardown.TeardownEngine(self.gnocchi_fetcher,
+                                              mock_conductor_api(self.dbapi))
+
+    def test_submit(self):
+        clients = {nova: mock.Mock(), cinder: mock.Mock()}
+        with mock.patch.dict(teardown.client_map, clients):
+            with mock.patch.object(nova, 'drop_resource') as drop_server:
+                with mock.patch.object(cinder,
+                                       'drop_resource') as drop_volume:
+                    thread = self.engine.submit('project-1')
+                    self.assertIsNone(self.engine.submit('project-1'))
+                    self.assertEqual(6, thread.wait())
+
+        self.assertNotIn('project-1', self.engine._projects)
+        self.gnocchi_fetcher.get_resources.assert_any_call(
+            'project-1', 'instance', started_after=None)
+        self.gnocchi_fetcher.get_resources.assert_any_call(
+            'project-1', 'volume', started_after=None)
+        self.assertEqual(3, drop_server.call_count)
+        self.assertEqual(3, drop_volume.call_count)
+        # One client per service
+        clients[nova].assert_called_once_with()
+        clients[cinder].assert_called_once_with()
+        drop_server.assert_any_call(
+            'compute', 'instance-0', client=clients[nova].return_value)
+
+    def test_submit_again(self):
+        with mock.patch.dict(teardown.client_map,
+                             {nova: mock.Mock(), cinder: mock.Mock()}):
+            with mock.patch.object(nova, 'drop_resource') as drop_server:
+                with mock.patch.object(
+                        cinder, 'drop_resource',
+                        side_effect=[None, ValueError('in-use'), None,
+                                     None]) as drop_volume:
+                    self.assertEqual(5,
+                                     self.engine.submit('project-1').wait())
+                    self.assertEqual(1,
+                                     self.engine.submit('project-1').wait())
+
+        self.assertEqual(3, drop_server.call_count)
+        self.assertEqual(4, drop_volume.call_count)
+        drop_volume.assert_called_with('volume.volume', 'volume-1',
+                                       client=mock.ANY)
+        statuses = set(action['status'] for action in
+                       self.dbapi.get_teardown_actions(self.context,
+                                                       'project-1'))
+        self.assertEqual(set([teardown.DONE]), statuses)
+        # Only the resources started since the first scan are searched
+        kwargs = self.gnocchi_fetcher.get_resources.call_args[1]
+        self.assertIsNotNone(kwargs['started_after'])
+
+    def test_submit_default_services(self):
+        cfg.CONF.clear_override('services', group='processor')
+        resources = {
+            'volume': [
+                {'id': 'volume-0', 'metrics': {'volume.size': 'metric'}},
+                {'id': 'snapshot-0',
+                 'metrics': {'volume.snapshot.size': 'metric'}}],
+            'ratelimit': [
+                {'id': 'fip-0', 'metrics': {'ratelimit.fip': 'metric'}},
+                {'id': 'gw-0', 'metrics': {'ratelimit.gw': 'metric'}}]}
+        self.gnocchi_fetcher.get_resources.side_effect = (
+            lambda project_id, resource_type, **kwargs:
+                resources.get(resource_type, []))
+        with mock.patch.dict(teardown.client_map,
+                             {cinder: mock.Mock(), neutron: mock.Mock()}):
+            with mock.patch.object(cinder, 'drop_resource') as drop_volume:
+                with mock.patch.object(neutron,
+                                       'drop_resource') as drop_network:
+                    self.assertEqual(4,
+                                     self.engine.submit('project-1').wait())
+
+        # Each resource type is searched once
+        self.assertEqual(
+            ['image', 'instance', 'network_lbaas_loadbalancer', 'ratelimit',
+             'volume'],
+            sorted(call[0][1] for call in
+                   self.gnocchi_fetcher.get_resources.call_args_list))
+        self.assertEqual(
+            [mock.call('volume.snapshot', 'snapshot-0', client=mock.ANY),
+             mock.call('volume.volume', 'volume-0', client=mock.ANY)],
+            sorted(drop_volume.call_args_list))
+        self.assertEqual(
+            [mock.call('ratelimit.fip', 'fip-0', client=mock.ANY),
+             mock.call('ratelimit.gw', 'gw-0', client=mock.ANY)],
+            sorted(drop_network.call_args_list))
+
+    def test_ledger_per_service(self):
+        self.dbapi.set_teardown_actions(
+            self.context, 'project-1',
+            [dict(service='volume.volume', resource_id='resource-1',
+                  status=teardown.DONE)])
+        self.dbapi.set_teardown_actions(
+            self.context, 'project-1',
+            [dict(service='volume.snapshot', resource_id='resource-1',
+                  status=teardown.PENDING)])
+        self.assertEqual(
+            [('volume.snapshot', teardown.PENDING),
+             ('volume.volume', teardown.DONE)],
+            sorted((action['service'], action['status']) for action in
+                   self.dbapi.get_teardown_actions(self.context,
+                                                   'project-1')))
+
+    def test_submit_scan_failed(self):
+        self.gnocchi_fetcher.get_resources.side_effect = (
+            lambda project_id, resource_type, **kwargs:
+                None if resource_type == 'volume' else [])
+        self.assertEqual(0, self.engine.submit('project-1').wait())
+
+        # The failed scan is done again from the start
+        self.gnocchi_fetcher.get_resources.reset_mock()
+        self.engine.submit('project-1').wait()
+        self.gnocchi_fetcher.get_resources.assert_any_call(
+            'project-1', 'instance', started_after=None)
+
+    def test_submit_record_failed(self):
+        self.engine.conductor = mock.Mock()
+        self.engine.conductor.get_teardown_actions.return_value = []
+        self.engine.conductor.set_teardown_actions.side_effect = (
+            Exception('down'))
+        self.assertIsNone(self.engine.submit('project-1').wait())
+
+        # The scanned resources were not recorded, they are searched again
+        self.gnocchi_fetcher.get_resources.reset_mock()
+        self.engine.submit('project-1').wait()
+        self.gnocchi_fetcher.get_resources.assert_any_call(
+            'project-1', 'instance', started_after=None)